@@ -1,65 +1,226 @@
 import os
-import ast
+import copy
 import time
+import asyncio
+import hashlib
+import threading
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
-import time 
 import mimetypes
+from api.response_cache import ResponseCache
+from api.retry_policy import RetryPolicy
+from api.rate_limiter import get_rate_limiter
+from api.json_parser import parse_llm_json
+from api.single_flight import SingleFlight
+from api.shared_loop import SharedEventLoop
 load_dotenv()
 os.environ["GOOGLE_API_KEY"] = os.getenv("GEMINI_API_KEY")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 60 * 60)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "5000"))
+
 class GeminiProvider:
-    def __init__(self, profile=None, tools=None):
-        self.gemini_client = genai.Client(api_key=os.environ["GOOGLE_API_KEY"])
+    # All Gemini calls, sync or async, run on one shared background event loop so that
+    # a single semaphore caps the number of requests in flight across the whole process.
+    _shared_loop = SharedEventLoop("gemini-event-loop")
+    _semaphore = None
+    _default_cache = None
+    _default_cache_lock = threading.Lock()
+    _in_flight = SingleFlight()
+
+    def __init__(self, profile=None, tools=None, cache=None, retry_policy=None):
+        self.api_key = os.environ["GOOGLE_API_KEY"]
+        self.gemini_client = genai.Client(api_key=self.api_key)
         self.model = "gemini-1.5-flash"
+        self.rate_limiter = get_rate_limiter("gemini")
+        self.cache = cache if cache is not None else GeminiProvider.get_default_cache()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy.from_env("GEMINI")
         if profile and tools:
             self.chat= self.initialize_assistant(profile, tools)
         else:
             self.chat = None
 
-    def generate_response(self, prompt, remove_literals=False):
-        completion = self.gemini_client.models.generate_content(model= self.model, contents=prompt)
-        if remove_literals:
-            output = ast.literal_eval(completion.text)
-        else:
-            output = completion.text
-        return output
+    @classmethod
+    def _get_semaphore(cls):
+        # _complete always runs on _shared_loop (run_on_shared_loop / run_sync), and set_max_concurrency swaps the
+        # semaphore from a coroutine on that loop too, so both happen on one thread and cannot interleave.
+        if cls._semaphore is None:
+            cls._semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        return cls._semaphore
+
+    @classmethod
+    def set_max_concurrency(cls, max_concurrency):
+        async def replace_semaphore():
+            cls._semaphore = asyncio.Semaphore(max_concurrency)
+        cls._shared_loop.run_sync(replace_semaphore())
+
+    @classmethod
+    def get_default_cache(cls):
+        if not LLM_CACHE_ENABLED:
+            return None
+        with cls._default_cache_lock:
+            if cls._default_cache is None:
+                cls._default_cache = ResponseCache.create("llm-responses", ttl=LLM_CACHE_TTL, memory_entries=LLM_CACHE_MEMORY_ENTRIES, disk_entries=LLM_CACHE_DISK_ENTRIES)
+            return cls._default_cache
+
+    def cache_key(self, contents, generation_config=None):
+        if self.cache is None:
+            return None
+        return self.request_key(contents, generation_config)
+
+    def request_key(self, contents, generation_config=None):
+        if not isinstance(contents, str):
+            return None
+        config = None
+        schema = None
+        if generation_config is not None:
+            config = generation_config.model_dump(exclude={"response_schema"}, exclude_none=True)
+            schema = generation_config.response_schema
+            if hasattr(schema, "model_json_schema"):
+                schema = schema.model_json_schema()
+        prompt_hash = hashlib.sha256(contents.encode("utf-8")).hexdigest()
+        return ResponseCache.make_key(self.model, prompt_hash, config, schema)
+
+    async def _cached_text(self, cache_key):
+        if cache_key is None:
+            return None
+        return await asyncio.to_thread(self.cache.get, cache_key)
+
+    async def _store_text(self, cache_key, text):
+        if cache_key is not None:
+            await asyncio.to_thread(self.cache.set, cache_key, text)
+
+    def run_sync(self, coro):
+        return GeminiProvider._shared_loop.run_sync(coro)
+
+    async def run_on_shared_loop(self, coro):
+        return await GeminiProvider._shared_loop.run(coro)
+
+    @staticmethod
+    def estimate_tokens(contents):
+        if isinstance(contents, str):
+            return len(contents) // 4 + 1
+        if isinstance(contents, list):
+            # Non-text parts (images, uploaded files) are charged the per-image cost up front and corrected afterwards.
+            return sum(GeminiProvider.estimate_tokens(part) if isinstance(part, str) else 258 for part in contents)
+        return 0
+
+    async def _generate_content(self, **kwargs):
+        estimated_tokens = GeminiProvider.estimate_tokens(kwargs.get("contents"))
+        await self.rate_limiter.aacquire(self.api_key, tokens=estimated_tokens)
+        async with GeminiProvider._get_semaphore():
+            completion = await self.gemini_client.aio.models.generate_content(**kwargs)
+        total_tokens = getattr(getattr(completion, "usage_metadata", None), "total_token_count", None)
+        if total_tokens:
+            await self.rate_limiter.arecord(self.api_key, total_tokens - estimated_tokens)
+        return completion
+
+    @staticmethod
+    def build_generation_config(response_schema=None, markdown=False):
+        if markdown:
+            return types.GenerateContentConfig()
+        if response_schema is None:
+            return types.GenerateContentConfig(
+                response_mime_type="application/json",
+                temperature=0.5
+            )
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema = response_schema,
+            temperature=0.5
+        )
+
+    async def _complete(self, contents, generation_config=None, parse=None, shape=None):
+        request_key = self.request_key(contents, generation_config)
+        if request_key is None:
+            return await self._complete_once(contents, generation_config, parse, shape)
+        # Identical prompts issued while one is already in flight wait for it instead of spending quota again.
+        # Callers mutate the parsed output, so each one gets its own copy.
+        output = await GeminiProvider._in_flight.ado((request_key, getattr(parse, "__name__", None), GeminiProvider._shape_key(shape)), self._complete_once, contents, generation_config, parse, shape)
+        return copy.deepcopy(output)
 
-    def generate_json_response(self, prompt, response_schema=None, markdown=False, file=None):
+    @staticmethod
+    def _shape_key(shape):
+        if shape is None:
+            return None
+        expected_type, required_keys = shape
+        return getattr(expected_type, "__name__", None), tuple(required_keys)
+
+    @staticmethod
+    def check_shape(output, generation_config=None, shape=None):
+        """Raises ValueError when parsed output is not what the caller or the response schema asked for, so it is
+        retried like a parse failure instead of being cached."""
+        schema = getattr(generation_config, "response_schema", None)
+        if hasattr(schema, "model_validate"):
+            # pydantic's ValidationError is a ValueError.
+            schema.model_validate(output)
+        if shape is None:
+            return
+        expected_type, required_keys = shape
+        if expected_type is not None and not isinstance(output, expected_type):
+            raise ValueError(f"Expected a JSON {expected_type.__name__}, got {type(output).__name__}")
+        missing = [key for key in required_keys if key not in output]
+        if missing:
+            raise ValueError(f"Response is missing the keys {missing}")
+
+    async def _complete_once(self, contents, generation_config=None, parse=None, shape=None):
+        cache_key = self.cache_key(contents, generation_config)
+        cached_text = await self._cached_text(cache_key)
+        retry_state = self.retry_policy.start()
         while True:
             try:
-                if markdown:
-                    generation_config= types.GenerateContentConfig()
-                elif response_schema is None:
-                    generation_config= types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        temperature=0.5
-                    )
+                from_cache = cached_text is not None
+                if from_cache:
+                    text, cached_text = cached_text, None
                 else:
-                    generation_config= types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        response_schema = response_schema,
-                        temperature=0.5
-                    )
-                if file is not None:
-                    completion = self.gemini_client.models.generate_content(
-                        model = self.model,
-                        contents=[types.Part.from_uri(file_uri=file.uri, mime_type=file.mime_type), prompt],
-                        config=generation_config,
+                    completion = await asyncio.wait_for(
+                        self._generate_content(model=self.model, contents=contents, config=generation_config),
+                        timeout=retry_state.remaining(),
                     )
+                    text = completion.text
+                repaired = False
+                if parse is parse_llm_json:
+                    output, repaired = parse_llm_json(text, report_repair=True)
                 else:
-                    completion = self.gemini_client.models.generate_content(
-                        model=self.model,
-                        contents=prompt,
-                        config=generation_config,
-                    )
-                if markdown:
-                    return completion.text
-                output = ast.literal_eval(completion.text)
+                    output = parse(text) if parse is not None else text
+                if parse is not None:
+                    GeminiProvider.check_shape(output, generation_config, shape)
+                # A truncated response that had to be cut back is used once but never cached.
+                if not from_cache and not repaired:
+                    await self._store_text(cache_key, text)
                 return output
             except Exception as e:
-                print("Invalid JSON response, retrying in 10 seconds...")
-                time.sleep(3)
+                delay = retry_state.next_delay(e)
+                if delay is None:
+                    print(f"Gemini request failed after {retry_state.attempts} attempt(s) ({retry_state.last_error_class}): {e}")
+                    raise
+                print(f"Gemini request failed ({retry_state.last_error_class}), retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+    def generate_response(self, prompt, remove_literals=False):
+        return self.run_sync(self.agenerate_response(prompt, remove_literals=remove_literals))
+
+    async def agenerate_response(self, prompt, remove_literals=False):
+        parse = parse_llm_json if remove_literals else None
+        return await self.run_on_shared_loop(self._complete(prompt, parse=parse))
+
+    def generate_json_response(self, prompt, response_schema=None, markdown=False, file=None, expected_type=None, required_keys=()):
+        return self.run_sync(self.agenerate_json_response(prompt, response_schema=response_schema, markdown=markdown, file=file, expected_type=expected_type, required_keys=required_keys))
+
+    async def agenerate_json_response(self, prompt, response_schema=None, markdown=False, file=None, expected_type=None, required_keys=()):
+        """expected_type and required_keys describe the JSON the caller needs; other responses are retried and
+        never cached."""
+        generation_config = GeminiProvider.build_generation_config(response_schema=response_schema, markdown=markdown)
+        if file is not None:
+            contents = [types.Part.from_uri(file_uri=file.uri, mime_type=file.mime_type), prompt]
+        else:
+            contents = prompt
+        parse = None if markdown else parse_llm_json
+        shape = (expected_type, tuple(required_keys)) if expected_type is not None or required_keys else None
+        return await self.run_on_shared_loop(self._complete(contents, generation_config, parse=parse, shape=shape))
 
     def upload_file(self, file_path, mime_type="video/mp4"):
         print("Uploading file...")
@@ -77,20 +238,23 @@ class GeminiProvider:
     def delete_file(self, file):
         print("Deleting file...")
         return self.gemini_client.files.delete(name=file.name)
-    
-    def explain_two_image(self, prompt, image1_path, image2_path):
+
+    @staticmethod
+    def _image_parts(image1_path, image2_path):
         with open(image1_path, 'rb') as f:
             image1_bytes = f.read()
         with open(image2_path, 'rb') as f:
             image2_bytes = f.read()
         mime_type1 = mimetypes.guess_type(image1_path)[0] or "application/octet-stream"  
         mime_type2 = mimetypes.guess_type(image2_path)[0] or "application/octet-stream"
+        return types.Part.from_bytes(data=image1_bytes, mime_type=mime_type1), types.Part.from_bytes(data=image2_bytes, mime_type=mime_type2)
 
-        completion = self.gemini_client.models.generate_content(
-            model= "gemini-1.5-flash",
-            contents=[prompt, types.Part.from_bytes(data=image1_bytes, mime_type=mime_type1), types.Part.from_bytes(data=image2_bytes, mime_type=mime_type2), prompt],
-        )
-        return completion.text
+    def explain_two_image(self, prompt, image1_path, image2_path):
+        return self.run_sync(self.aexplain_two_image(prompt, image1_path, image2_path))
+
+    async def aexplain_two_image(self, prompt, image1_path, image2_path):
+        image1_part, image2_part = await asyncio.to_thread(GeminiProvider._image_parts, image1_path, image2_path)
+        return await self.run_on_shared_loop(self._complete([prompt, image1_part, image2_part, prompt]))
     
     def initialize_assistant(self, profile, tools):
         self.chat = self.gemini_client.chats.create(
@@ -104,4 +268,4 @@ class GeminiProvider:
     def return_chat(self):
         if self.chat is None:
             raise AttributeError("Chat has not been initialized. Call 'initialize_assistant' first.")
-        return self.chat
\ No newline at end of file
+        return self.chat
@@ -0,0 +1,130 @@
+import re
+import ast
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FENCED_BLOCK = re.compile(r"```(?:json|JSON|python)?\s*\n?(.*?)(?:```|$)", re.DOTALL)
+DANGLING_COMMA_FOLLOWER = re.compile(r"\s*(?:[}\]]|$)")
+MAX_TRUNCATION_CANDIDATES = 25
+
+
+def _loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _strip_fences(text):
+    match = FENCED_BLOCK.search(text)
+    if match:
+        text = match.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if starts:
+        text = text[min(starts):]
+    end = _scan(text)[5]
+    if end is not None:
+        text = text[:end + 1]
+    return text.strip()
+
+
+def _scan(text):
+    """Walk the text outside of string literals. Returns the commas that can be dropped, the cut points
+    (commas) with the container stack at each, the final stack, where the first top-level value ends and
+    the string state."""
+    stack = []
+    end = None
+    dangling_commas = []
+    cut_points = []
+    in_string = False
+    escape = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+                if not stack and end is None:
+                    end = i
+        elif char == ",":
+            cut_points.append((i, tuple(stack)))
+            if DANGLING_COMMA_FOLLOWER.match(text, i + 1):
+                dangling_commas.append(i)
+    return dangling_commas, cut_points, stack, in_string, escape, end
+
+
+def _closers(stack):
+    return "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+
+def _remove_trailing_commas(text):
+    dangling_commas = set(_scan(text)[0])
+    return "".join(char for i, char in enumerate(text) if i not in dangling_commas)
+
+
+def _repair_truncated(text):
+    _, cut_points, stack, in_string, escape, _ = _scan(text)
+    tail = text[:-1] if escape else text
+    if in_string:
+        tail += '"'
+    tail = tail.rstrip()
+    if tail.endswith(":"):
+        tail += " null"
+    tail = tail.rstrip(",").rstrip()
+    closed_in_place = tail + _closers(stack)
+    # Dropping the last, partially generated element of the innermost container comes first. Closing the
+    # open containers where the text stops is only safe when it stopped right after a complete element.
+    cut_candidates = [text[:position] + _closers(stack_at_cut) for position, stack_at_cut in reversed(cut_points[-MAX_TRUNCATION_CANDIDATES:])]
+    if not in_string and tail.endswith(("}", "]")):
+        candidates = [closed_in_place] + cut_candidates
+    else:
+        candidates = cut_candidates or [closed_in_place]
+    for candidate in candidates:
+        try:
+            output = _loads(candidate)
+        except ValueError:
+            continue
+        # An empty container means nothing useful survived the repair; let the caller regenerate.
+        if output:
+            return output
+    raise ValueError("Could not repair truncated JSON response")
+
+
+def parse_llm_json(text, report_repair=False):
+    """Parsed JSON from a model response. With report_repair, returns (output, repaired), where repaired says
+    whether a truncated response had to be cut back to parse; such output should not be cached."""
+    if text is None:
+        raise ValueError("Empty response")
+    output = None
+    repaired = False
+    try:
+        output = _loads(text)
+    except ValueError:
+        try:
+            # Older prompts sometimes get Python-style dicts back (single quotes, True/None). A set of dicts, as
+            # in the submodule prompts' example format, raises TypeError (unhashable dict).
+            output = ast.literal_eval(text.strip())
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            cleaned = _remove_trailing_commas(_strip_fences(text))
+            try:
+                output = _loads(cleaned)
+            except ValueError:
+                output = _repair_truncated(cleaned)
+                repaired = True
+                print("Repaired truncated JSON response")
+    if report_repair:
+        return output, repaired
+    return output
@@ -0,0 +1,86 @@
+import time
+import threading
+from contextlib import contextmanager
+from api.retry_policy import classify_error, retry_after_seconds, RATE_LIMIT
+
+
+class KeyStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.consecutive_rate_limits = 0
+        self.last_throttled_at = 0.0
+        self.benched_until = 0.0
+
+    def to_dict(self):
+        return {
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "benched_for": max(0.0, self.benched_until - time.time()),
+        }
+
+
+class KeyPool:
+    def __init__(self, keys, bench_seconds=60, max_bench_seconds=900):
+        # An empty pool can be built (pools are created at import time, before anyone knows whether the
+        # provider will be used); it only fails when a key is asked for.
+        self.keys = [key for key in dict.fromkeys(keys) if key]
+        self.bench_seconds = bench_seconds
+        self.max_bench_seconds = max_bench_seconds
+        self._stats = {key: KeyStats() for key in self.keys}
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.keys:
+            raise ValueError("KeyPool needs at least one API key")
+        with self._lock:
+            now = time.time()
+            available = [key for key in self.keys if self._stats[key].benched_until <= now]
+            if available:
+                # Least loaded first, then the key that has gone longest without being throttled.
+                key = min(available, key=lambda k: (self._stats[k].in_flight, self._stats[k].last_throttled_at, self._stats[k].calls))
+            else:
+                key = min(self.keys, key=lambda k: self._stats[k].benched_until)
+            stats = self._stats[key]
+            stats.in_flight += 1
+            stats.calls += 1
+            return key
+
+    def release(self, key, exc=None):
+        with self._lock:
+            stats = self._stats[key]
+            stats.in_flight -= 1
+            if exc is None:
+                stats.consecutive_rate_limits = 0
+                return
+            stats.errors += 1
+            if classify_error(exc) == RATE_LIMIT:
+                now = time.time()
+                stats.rate_limited += 1
+                stats.consecutive_rate_limits += 1
+                stats.last_throttled_at = now
+                bench = retry_after_seconds(exc)
+                if bench is None:
+                    bench = min(self.max_bench_seconds, self.bench_seconds * 2 ** (stats.consecutive_rate_limits - 1))
+                stats.benched_until = now + bench
+                print(f"API key ...{key[-4:]} rate limited, benched for {bench:.0f} seconds")
+
+    @contextmanager
+    def lease(self):
+        key = self.acquire()
+        error = None
+        try:
+            yield key
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(key, error)
+
+    def stats(self):
+        with self._lock:
+            return {f"...{key[-4:]}": self._stats[key].to_dict() for key in self.keys}
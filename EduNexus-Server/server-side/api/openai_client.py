@@ -3,6 +3,7 @@ import ast
 from dotenv import load_dotenv
 from openai import OpenAI
 from server.teacher.routes import session
+from api.json_parser import parse_llm_json
 
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
@@ -20,7 +21,7 @@ class OpenAIProvider:
                     response_format = {'type':'json_object'},
                     seed = 42
                 )
-        output = ast.literal_eval(completion.choices[0].message.content)
+        output = parse_llm_json(completion.choices[0].message.content)
         return output
     
     def initialize_assistant_and_thread(self, profile, tools):
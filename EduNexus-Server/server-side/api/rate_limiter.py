@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from dotenv import load_dotenv
+from api.response_cache import CACHE_DIRECTORY
+from api.storage import init_database, write_transaction
+
+load_dotenv()
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", os.path.join(CACHE_DIRECTORY, "rate-limits.sqlite3"))
+DEFAULT_LIMITS = {
+    "gemini": {"requests_per_minute": 2000, "tokens_per_minute": 4000000},
+    "tavily": {"requests_per_minute": 100, "tokens_per_minute": None},
+    "serper": {"requests_per_minute": 300, "tokens_per_minute": None},
+    "serpapi": {"requests_per_minute": 60, "tokens_per_minute": None},
+}
+
+
+class MemoryBucketStore:
+    blocking = False
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, amount, capacity, refill_per_second):
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens, wait = _reserve(tokens, updated_at, now, amount, capacity, refill_per_second)
+            self._buckets[key] = (tokens, now)
+            return wait
+
+
+class SQLiteBucketStore:
+    """Bucket state in a SQLite file so that every worker process on the host draws from the same budget."""
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+        init_database(path, "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+
+    def reserve(self, key, amount, capacity, refill_per_second):
+        with write_transaction(self.path) as conn:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row is not None else (capacity, now)
+            tokens, wait = _reserve(tokens, updated_at, now, amount, capacity, refill_per_second)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+        return wait
+
+
+def _reserve(tokens, updated_at, now, amount, capacity, refill_per_second):
+    # Reservations may drive the bucket negative; the caller then waits out the deficit. This queues callers
+    # in arrival order instead of letting them all poll and retry at once.
+    tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+    tokens -= min(amount, capacity)
+    wait = -tokens / refill_per_second if tokens < 0 else 0.0
+    return tokens, wait
+
+
+class RateLimiter:
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None, store=None):
+        self.provider = provider
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.store = store if store is not None else MemoryBucketStore()
+
+    def _bucket_key(self, api_key, bucket):
+        key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else "default"
+        return f"{self.provider}:{key_id}:{bucket}"
+
+    def _reserve(self, api_key, tokens):
+        wait = 0.0
+        if self.requests_per_minute:
+            wait = max(wait, self.store.reserve(self._bucket_key(api_key, "requests"), 1, self.requests_per_minute, self.requests_per_minute / 60))
+        if self.tokens_per_minute and tokens:
+            wait = max(wait, self.store.reserve(self._bucket_key(api_key, "tokens"), tokens, self.tokens_per_minute, self.tokens_per_minute / 60))
+        return wait
+
+    def acquire(self, api_key=None, tokens=0):
+        wait = self._reserve(api_key, tokens)
+        if wait > 0:
+            print(f"Rate limit for {self.provider} reached, waiting {wait:.1f} seconds...")
+            time.sleep(wait)
+
+    async def aacquire(self, api_key=None, tokens=0):
+        if self.store.blocking:
+            wait = await asyncio.to_thread(self._reserve, api_key, tokens)
+        else:
+            wait = self._reserve(api_key, tokens)
+        if wait > 0:
+            print(f"Rate limit for {self.provider} reached, waiting {wait:.1f} seconds...")
+            await asyncio.sleep(wait)
+
+    def record(self, api_key=None, tokens=0):
+        """Charge tokens that were only known after the call (e.g. output tokens) without waiting."""
+        if self.tokens_per_minute and tokens > 0:
+            self.store.reserve(self._bucket_key(api_key, "tokens"), tokens, self.tokens_per_minute, self.tokens_per_minute / 60)
+
+    async def arecord(self, api_key=None, tokens=0):
+        if self.store.blocking:
+            await asyncio.to_thread(self.record, api_key, tokens)
+        else:
+            self.record(api_key, tokens)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+_shared_store = None
+
+
+def _limit_from_env(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return int(value) or None
+
+
+def get_rate_limiter(provider):
+    global _shared_store
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            if _shared_store is None:
+                _shared_store = SQLiteBucketStore(RATE_LIMIT_DB_PATH) if RATE_LIMIT_BACKEND == "sqlite" else MemoryBucketStore()
+            defaults = DEFAULT_LIMITS.get(provider, {})
+            _rate_limiters[provider] = RateLimiter(
+                provider,
+                requests_per_minute=_limit_from_env(f"{provider.upper()}_RPM", defaults.get("requests_per_minute")),
+                tokens_per_minute=_limit_from_env(f"{provider.upper()}_TPM", defaults.get("tokens_per_minute")),
+                store=_shared_store,
+            )
+        return _rate_limiters[provider]
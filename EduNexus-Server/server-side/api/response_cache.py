@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from api.storage import connect, init_database
+
+load_dotenv()
+CACHE_DIRECTORY = os.getenv("CACHE_DIRECTORY", os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache"))
+
+
+class MemoryCache:
+    """In-process LRU tier. Entries are (value, stored_at) pairs."""
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at=None):
+        with self._lock:
+            self._entries[key] = (value, stored_at if stored_at is not None else time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """On-disk tier shared by every worker process on the host. Values are stored as JSON text."""
+    def __init__(self, path, table="entries", max_entries=5000, ttl=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._writes = 0
+        init_database(
+            path,
+            f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at ON {self.table} (accessed_at)",
+        )
+
+    def get(self, key):
+        now = time.time()
+        with connect(self.path) as conn:
+            row = conn.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at=None):
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), stored_at if stored_at is not None else now, now),
+            )
+            self._writes += 1
+            # Evicting on every write would turn each insert into a table scan, so trim in batches.
+            if self._writes % 50 == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        if self.ttl is not None:
+            conn.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl,))
+        count = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def delete(self, key):
+        with connect(self.path) as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        with connect(self.path) as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        with connect(self.path) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class ResponseCache:
+    """Read-through cache over an ordered list of tiers (fastest first) with hit/miss counters."""
+    def __init__(self, tiers):
+        self.tiers = list(tiers)
+        self.hits = 0
+        self.misses = 0
+        self.tier_hits = [0] * len(self.tiers)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        payload = json.dumps(parts, sort_keys=True, default=repr, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            entry = tier.get(key)
+            if entry is None:
+                continue
+            for faster_tier in self.tiers[:i]:
+                faster_tier.set(key, entry[0], stored_at=entry[1])
+            with self._lock:
+                self.hits += 1
+                self.tier_hits[i] += 1
+            return entry[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        stored_at = time.time()
+        for tier in self.tiers:
+            tier.set(key, value, stored_at=stored_at)
+
+    def delete(self, key):
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "tier_hits": {type(tier).__name__: count for tier, count in zip(self.tiers, self.tier_hits)},
+            }
+
+    @classmethod
+    def create(cls, name, ttl=None, memory_entries=256, disk_entries=5000, disk=True):
+        tiers = [MemoryCache(max_entries=memory_entries, ttl=ttl)]
+        if disk:
+            tiers.append(SQLiteCache(os.path.join(CACHE_DIRECTORY, f"{name}.sqlite3"), max_entries=disk_entries, ttl=ttl))
+        return cls(tiers)
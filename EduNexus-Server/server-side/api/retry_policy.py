@@ -0,0 +1,128 @@
+import os
+import re
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RATE_LIMIT = "rate_limit"
+PARSE_FAILURE = "parse_failure"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+
+def error_status_code(exc):
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    for attr in ("status_code", "status"):
+        value = getattr(response, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def classify_error(exc):
+    status_code = error_status_code(exc)
+    if status_code == 429 or "RESOURCE_EXHAUSTED" in str(exc) or re.search(r"rate.?limit|usage.?limit", type(exc).__name__, re.IGNORECASE):
+        return RATE_LIMIT
+    if isinstance(exc, (ValueError, SyntaxError)) and status_code is None:
+        return PARSE_FAILURE
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return TRANSIENT
+    if status_code is not None:
+        if status_code == 408 or status_code >= 500:
+            return TRANSIENT
+        if 400 <= status_code < 500:
+            return FATAL
+    return TRANSIENT
+
+
+def retry_after_seconds(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    # Gemini reports the server-suggested delay as a RetryInfo detail, e.g. "retryDelay": "17s".
+    match = re.search(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(exc, "details", "") or exc))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, max_parse_attempts=3, base_delay=1.0, max_delay=30.0, parse_delay=0.5, deadline=120.0, jitter=True):
+        self.max_attempts = max_attempts
+        self.max_parse_attempts = max_parse_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.parse_delay = parse_delay
+        self.deadline = deadline
+        self.jitter = jitter
+
+    @classmethod
+    def from_env(cls, prefix="GEMINI"):
+        return cls(
+            max_attempts=int(os.getenv(f"{prefix}_MAX_ATTEMPTS", "5")),
+            max_parse_attempts=int(os.getenv(f"{prefix}_MAX_PARSE_ATTEMPTS", "3")),
+            base_delay=float(os.getenv(f"{prefix}_RETRY_BASE_DELAY", "1.0")),
+            max_delay=float(os.getenv(f"{prefix}_RETRY_MAX_DELAY", "30.0")),
+            deadline=float(os.getenv(f"{prefix}_REQUEST_DEADLINE", "120.0")),
+        )
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        if self.jitter:
+            # Full jitter spreads retries from many workers instead of synchronising them.
+            delay = random.uniform(0, delay)
+        return delay
+
+    def start(self):
+        return RetryState(self)
+
+
+class RetryState:
+    def __init__(self, policy):
+        self.policy = policy
+        self.started_at = time.monotonic()
+        self.attempts = 0
+        self.parse_failures = 0
+        self.last_error_class = None
+
+    def remaining(self):
+        if self.policy.deadline is None:
+            return None
+        return max(0.0, self.policy.deadline - (time.monotonic() - self.started_at))
+
+    def next_delay(self, exc):
+        """Record a failed attempt and return how long to wait before the next one, or None to give up."""
+        self.attempts += 1
+        self.last_error_class = classify_error(exc)
+        if self.last_error_class == FATAL or self.attempts >= self.policy.max_attempts:
+            return None
+        if self.last_error_class == PARSE_FAILURE:
+            self.parse_failures += 1
+            if self.parse_failures >= self.policy.max_parse_attempts:
+                return None
+            delay = self.policy.parse_delay
+        elif self.last_error_class == RATE_LIMIT:
+            retry_after = retry_after_seconds(exc)
+            delay = retry_after if retry_after is not None else self.policy.backoff(self.attempts)
+        else:
+            delay = self.policy.backoff(self.attempts)
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
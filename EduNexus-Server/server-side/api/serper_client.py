@@ -1,125 +1,172 @@
-import json
 import os
-import requests
+import asyncio
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from serpapi import GoogleSearch
+from api.rate_limiter import get_rate_limiter
+from api.shared_loop import SharedEventLoop
+from api.single_flight import SingleFlight
+from api.response_cache import ResponseCache
 
 load_dotenv()
 serper_api_key = os.getenv('SERPER_API_KEY')
 google_serp_api_key = os.getenv('GOOGLE_SERP_API_KEY')
+SERPER_RATE_LIMITER = get_rate_limiter("serper")
+SERPAPI_RATE_LIMITER = get_rate_limiter("serpapi")
+SERPER_IMAGES_URL = "https://google.serper.dev/images"
+SERPER_MAX_CONCURRENCY = int(os.getenv("SERPER_MAX_CONCURRENCY", "8"))
+SERPER_TIMEOUT = float(os.getenv("SERPER_TIMEOUT", "10"))
+SERPER_CONNECT_TIMEOUT = float(os.getenv("SERPER_CONNECT_TIMEOUT", "3"))
+SERPAPI_MAX_CONCURRENCY = int(os.getenv("SERPAPI_MAX_CONCURRENCY", "6"))
+# Video and course listings for a topic change over days, not minutes.
+SERPAPI_CACHE_TTL = int(os.getenv("SERPAPI_CACHE_TTL", str(24 * 60 * 60)))
+SERPAPI_CACHE = ResponseCache.create("serpapi-results", ttl=SERPAPI_CACHE_TTL, memory_entries=int(os.getenv("SERPAPI_CACHE_MEMORY_ENTRIES", "512")), disk_entries=int(os.getenv("SERPAPI_CACHE_DISK_ENTRIES", "20000")))
+# Videos listed per submodule; the cache keeps every link so callers can ask for as many as they need.
+MODULE_VIDEO_LINKS = 10
+TRUSTED_COURSE_SOURCES = ["Coursera","edX", "Udacity", "upGrad", "FutureLearn", "Udemy", "Harvard University"]
 
 class SerperProvider:
+    # Serper requests from every thread go through one keep-alive httpx.AsyncClient on a shared event loop,
+    # and a semaphore on that loop caps how many are in flight at once.
+    _shared_loop = SharedEventLoop("serper-event-loop")
+    _client = None
+    _semaphore = None
+    _serpapi_in_flight = SingleFlight()
+
+    @classmethod
+    def _get_client(cls):
+        # _search_images is the only caller, and every search is a coroutine on _shared_loop's one thread; there
+        # is no await between the check and the assignment, so a second client or semaphore is never made.
+        if cls._client is None:
+            cls._client = httpx.AsyncClient(
+                headers={'X-API-KEY': serper_api_key or '', 'Content-Type': 'application/json'},
+                timeout=httpx.Timeout(SERPER_TIMEOUT, connect=SERPER_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=SERPER_MAX_CONCURRENCY, max_keepalive_connections=SERPER_MAX_CONCURRENCY),
+            )
+            cls._semaphore = asyncio.Semaphore(SERPER_MAX_CONCURRENCY)
+        return cls._client
+
+    @staticmethod
+    async def _search_images(query):
+        client = SerperProvider._get_client()
+        async with SerperProvider._semaphore:
+            await SERPER_RATE_LIMITER.aacquire(serper_api_key)
+            try:
+                response = await client.post(SERPER_IMAGES_URL, json={"q": query})
+                response.raise_for_status()
+                image_results = response.json()["images"]
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                # One failed lookup leaves that submodule without web images rather than failing the module.
+                print(f"Error fetching images for {query}: {e}")
+                return []
+        return [i["imageUrl"] for i in image_results]
+
+    @staticmethod
+    async def _images_for_queries(queries):
+        return await asyncio.gather(*[SerperProvider._search_images(query) for query in queries])
+
     @staticmethod
     def module_image_from_web(submodules:dict):
         print('FETCHING IMAGES...')
-        keys_list = list(submodules.keys())
-        url = "https://google.serper.dev/images"
-        headers = {
-            'X-API-KEY': serper_api_key,
-            'Content-Type': 'application/json'
-        }
-        images_list=[]
-        for key in keys_list:
-            payload = json.dumps({
-                "q": submodules[key]
-            })
-            response = requests.request("POST", url, headers=headers, data=payload)
-            json_response = json.loads(response.text)
-            image_results = json_response["images"]
-            image_links = [i["imageUrl"] for i in image_results]
-            images_list.append(image_links)
-        return images_list
+        return SerperProvider._shared_loop.run_sync(SerperProvider._images_for_queries(list(submodules.values())))
+
+    @staticmethod
+    async def amodule_image_from_web(submodules:dict):
+        return await SerperProvider._shared_loop.run(SerperProvider._images_for_queries(list(submodules.values())))
     
     @staticmethod
     async def submodule_image_from_web(submodule_name):
-        url = "https://google.serper.dev/images"
-        headers = {
-            'X-API-KEY': serper_api_key,
-            'Content-Type': 'application/json'
-        }
-        payload = json.dumps({
-            "q": submodule_name
-        })
-        response = requests.request("POST", url, headers=headers, data=payload)
-        json_response = json.loads(response.text)
-        image_results = json_response["images"]
-        image_links = [i["imageUrl"] for i in image_results]
-        return image_links
+        image_links = await SerperProvider._shared_loop.run(SerperProvider._images_for_queries([submodule_name]))
+        return image_links[0]
     
     @staticmethod
-    def module_videos_from_web(submodules):
-        print('FETCHING VIDEOS...')
-        keys_list = list(submodules.keys())
-        videos_list=[]
-        for key in keys_list:
-            params = {
-                "q": submodules[key],
-                "engine": "google_videos",
-                "ijn": "0",
-                "api_key": google_serp_api_key
-            }
-
-            search = GoogleSearch(params)
-            results = search.get_dict()
-            video_results = results["video_results"]
-            yt_links = [i['link'] for i in video_results[:10]]
-            videos_list.append(yt_links)
-        return videos_list
-    
+    def normalize_query(query):
+        return " ".join(str(query).lower().split())
+
     @staticmethod
-    def search_videos_from_web(query : str, n_videos : int = 5):
+    def _cached_serpapi_search(kind, params, extract):
+        """Runs a SerpAPI search through the result cache, keyed by the normalized query and the other search
+        parameters. Identical searches already in flight are shared rather than repeated."""
+        key = ResponseCache.make_key("serpapi", kind, SerperProvider.normalize_query(params["q"]), {name: value for name, value in params.items() if name != "q"})
+        cached = SERPAPI_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+        def search():
+            SERPAPI_RATE_LIMITER.acquire(google_serp_api_key)
+            results = GoogleSearch({**params, "api_key": google_serp_api_key}).get_dict()
+            if "error" in results:
+                # Quota and key errors are not cached.
+                raise Exception(results["error"])
+            value = extract(results)
+            SERPAPI_CACHE.set(key, value)
+            return value
+
+        return SerperProvider._serpapi_in_flight.do(key, search)
+
+    @staticmethod
+    def _map_concurrently(func, items):
+        items = list(items)
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(SERPAPI_MAX_CONCURRENCY, len(items))) as executor:
+            return list(executor.map(func, items))
+
+    @staticmethod
+    def _video_links(query):
         params = {
             "q": query,
             "engine": "google_videos",
             "ijn": "0",
-            "api_key": google_serp_api_key
         }
+        return SerperProvider._cached_serpapi_search("video-links", params, lambda results: [i['link'] for i in results["video_results"]])
+
+    @staticmethod
+    def module_videos_from_web(submodules):
+        print('FETCHING VIDEOS...')
+        return SerperProvider._map_concurrently(lambda query: SerperProvider._video_links(query)[:MODULE_VIDEO_LINKS], submodules.values())
+    
+    @staticmethod
+    def search_videos_from_web(query : str, n_videos : int = 5):
+        return SerperProvider._video_links(query)[:n_videos]
 
-        search = GoogleSearch(params)
-        results = search.get_dict()
-        video_results = results["video_results"]
-        yt_links = [i['link'] for i in video_results[:n_videos]]
-        return yt_links
+    @staticmethod
+    def extract_course_links(search_results : dict):
+        """Extracts valid course links from inline sitelinks."""
+        course_links = []
+        for result in search_results.get("organic_results", []):
+            source = result.get("source")
+            sitelinks = result.get("sitelinks", {}).get("inline", [])
+            if source in TRUSTED_COURSE_SOURCES and sitelinks:
+                for sitelink in sitelinks:
+                    link = sitelink.get("link")
+                    if link :
+                        course_links.append({
+                            "source": source,
+                            "title": sitelink.get("title", "No Title"),
+                            "link": link
+                        })
+        return course_links
+
+    @staticmethod
+    def _skill_courses(skill):
+        params = {
+            "q": f"Courses on {skill}",
+            "engine": "google",
+            "location": "India"
+        }
+        try:
+            return SerperProvider._cached_serpapi_search("courses", params, SerperProvider.extract_course_links)
+        except Exception as e:
+            print(f"Error searching for {skill}: {e}")
+            return []
 
     @staticmethod
     def find_courses(skills : list):
-        
-        def extract_course_links(search_results : dict):
-            """Extracts valid course links from inline sitelinks."""
-            trusted_sources = ["Coursera","edX", "Udacity", "upGrad", "FutureLearn", "Udemy", "Harvard University"]
-            course_links = []
-
-            if "organic_results" not in search_results:
-                return course_links
-            for result in search_results.get("organic_results", []):
-                source = result.get("source")
-                sitelinks = result.get("sitelinks", {}).get("inline", [])
-                if source in trusted_sources and sitelinks:
-                    for sitelink in sitelinks:
-                        link = sitelink.get("link")
-                        if link :
-                            course_links.append({
-                                "source": source,
-                                "title": sitelink.get("title", "No Title"),
-                                "link": link
-                            })
-
-            return course_links
-        
         course_links = []
-        for skill in skills:
-            params = {
-                "q": f"Courses on {skill}",
-                "engine": "google",
-                "api_key": google_serp_api_key,
-                "location": "India"
-            }
-            try:
-                search = GoogleSearch(params)
-                results = search.get_dict()
-                extracted_links = extract_course_links(results)
-                if extracted_links:
-                    course_links = extracted_links
-            except Exception as e:
-                print(f"Error searching for {skill}: {e}")
-        return course_links
\ No newline at end of file
+        # As before, the last skill that has any course links wins.
+        for extracted_links in SerperProvider._map_concurrently(SerperProvider._skill_courses, skills):
+            if extracted_links:
+                course_links = extracted_links
+        return course_links
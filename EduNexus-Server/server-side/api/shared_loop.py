@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+
+class SharedEventLoop:
+    """An event loop running forever on a daemon thread, started on first use. Clients bound to one loop
+    (httpx.AsyncClient, asyncio semaphores) live on it, and callers on any thread or loop submit work to it."""
+    def __init__(self, name):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                thread.start()
+                self._loop = loop
+                self._thread = thread
+            return self._loop
+
+    def run_sync(self, coro):
+        loop = self.get()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError(f"Synchronous calls cannot be made from {self.name}; await the async API instead.")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def run(self, coro):
+        loop = self.get()
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key: the first caller runs the work and everyone who arrives
+    while it is in flight waits for and receives the same result (or exception). Nothing is remembered once
+    the call finishes; pair it with a cache for that."""
+    def __init__(self):
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """Returns (future, leader). The leader does the work and must settle it with finish(); everyone else
+        waits on the future. For work that cannot be wrapped in one call, e.g. a streamed response."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key, func, *args, **kwargs):
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    async def ado(self, key, coro_func, *args, **kwargs):
+        # The work runs as its own task and callers await it through shield(), so a caller that is cancelled
+        # (e.g. a disconnected client) does not cancel the generation the others are waiting for.
+        task_key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            task = asyncio.ensure_future(coro_func(*args, **kwargs))
+            self._tasks[task_key] = task
+            task.add_done_callback(lambda done: self._forget(task_key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, task_key, task):
+        if self._tasks.get(task_key) is task:
+            del self._tasks[task_key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every caller was cancelled before it finished.
+            task.exception()
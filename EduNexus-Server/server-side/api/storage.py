@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+# SQLite caps the number of bound parameters per statement.
+SQLITE_LOOKUP_CHUNK = 500
+FILE_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+@contextmanager
+def connect(path):
+    """A connection to the SQLite file at path whose block runs in a transaction, committed on success and rolled
+    back on error."""
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def write_transaction(path):
+    """connect, but the write lock is taken up front with BEGIN IMMEDIATE, so a read-modify-write in the block is
+    atomic across processes."""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def init_database(path, *statements):
+    """Creates the SQLite file at path in WAL mode, so readers in other worker processes on the host do not block
+    the writer, and runs the schema statements."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in statements:
+            conn.execute(statement)
+
+
+def select_in(conn, query, keys):
+    """Rows of query for keys, where query has a {placeholders} field for the IN (...) list. Keys are sent in
+    chunks of SQLITE_LOOKUP_CHUNK."""
+    keys = list(keys)
+    for i in range(0, len(keys), SQLITE_LOOKUP_CHUNK):
+        chunk = keys[i:i + SQLITE_LOOKUP_CHUNK]
+        yield from conn.execute(query.format(placeholders=", ".join("?" * len(chunk))), chunk)
+
+
+def hash_file(path, digest=None):
+    """digest (a new sha256 by default) updated with the bytes of the file at path."""
+    digest = digest if digest is not None else hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(FILE_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest
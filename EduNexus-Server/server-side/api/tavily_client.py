@@ -1,22 +1,146 @@
 import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from tavily import TavilyClient, AsyncTavilyClient
+from api.rate_limiter import get_rate_limiter
+from api.key_pool import KeyPool
+from api.retry_policy import classify_error, RATE_LIMIT
+from api.response_cache import ResponseCache
+from api.single_flight import SingleFlight
 
 load_dotenv()
 tavily_api_key1 = os.getenv('TAVILY_API_KEY1')
 tavily_api_key2 = os.getenv('TAVILY_API_KEY2')
 tavily_api_key3 = os.getenv('TAVILY_API_KEY3')
+# TAVILY_API_KEYS takes a comma-separated list so keys can be added without code changes.
+TAVILY_API_KEYS = [key.strip() for key in os.getenv('TAVILY_API_KEYS', '').split(',') if key.strip()] or [tavily_api_key1, tavily_api_key2, tavily_api_key3]
+TAVILY_KEY_POOL = KeyPool(TAVILY_API_KEYS, bench_seconds=int(os.getenv('TAVILY_KEY_BENCH_SECONDS', '60')))
+# Context younger than TAVILY_CACHE_TTL is served as is. Up to TAVILY_CACHE_STALE_TTL after that it is still
+# served, but a refresh is started in the background; older entries are fetched again before returning.
+TAVILY_CACHE_TTL = int(os.getenv('TAVILY_CACHE_TTL', str(6 * 60 * 60)))
+TAVILY_CACHE_STALE_TTL = int(os.getenv('TAVILY_CACHE_STALE_TTL', str(7 * 24 * 60 * 60)))
+TAVILY_CACHE = ResponseCache.create("tavily-context", ttl=TAVILY_CACHE_TTL + TAVILY_CACHE_STALE_TTL, memory_entries=int(os.getenv('TAVILY_CACHE_MEMORY_ENTRIES', '256')), disk_entries=int(os.getenv('TAVILY_CACHE_DISK_ENTRIES', '5000')))
+TAVILY_CACHE_LOG_EVERY = int(os.getenv('TAVILY_CACHE_LOG_EVERY', '100'))
 
 class TavilyProvider:
-    def __init__(self, flag=1):
-        active_api = tavily_api_key1 if flag==1 else(tavily_api_key2 if flag==2 else tavily_api_key3)
-        self.tavily_client = TavilyClient(api_key = active_api)
-        self.async_tavily_client = AsyncTavilyClient(api_key=active_api)
+    _clients = {}
+    _async_clients = {}
+    _clients_lock = threading.Lock()
+    _in_flight = SingleFlight()
+    _refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tavily-refresh")
+    _refreshing = set()
+    _stats_lock = threading.Lock()
+    _stale_hits = 0
+    _refreshes = 0
+
+    def __init__(self, key_pool=None):
+        self.key_pool = key_pool if key_pool is not None else TAVILY_KEY_POOL
+        self.rate_limiter = get_rate_limiter("tavily")
+
+    @classmethod
+    def get_client(cls, api_key):
+        with cls._clients_lock:
+            if api_key not in cls._clients:
+                cls._clients[api_key] = TavilyClient(api_key=api_key)
+            return cls._clients[api_key]
+
+    @classmethod
+    def get_async_client(cls, api_key):
+        with cls._clients_lock:
+            if api_key not in cls._async_clients:
+                cls._async_clients[api_key] = AsyncTavilyClient(api_key=api_key)
+            return cls._async_clients[api_key]
+
+    @staticmethod
+    def cache_key(topic, search_depth, max_tokens):
+        return ResponseCache.make_key("tavily", " ".join(str(topic).lower().split()), search_depth, max_tokens)
+
+    @classmethod
+    def cache_stats(cls):
+        with cls._stats_lock:
+            return {**TAVILY_CACHE.stats(), "stale_hits": cls._stale_hits, "refreshes": cls._refreshes}
+
+    def _cached_context(self, key, topic, search_depth, max_tokens):
+        """The cached context for key, or None on a miss. Stale entries are returned and refreshed in the background."""
+        entry = TAVILY_CACHE.get(key)
+        stats = TavilyProvider.cache_stats()
+        lookups = stats["hits"] + stats["misses"]
+        if TAVILY_CACHE_LOG_EVERY and lookups % TAVILY_CACHE_LOG_EVERY == 0:
+            print(f"Tavily cache: {stats['hits']}/{lookups} hits ({stats['hit_ratio']:.0%}), {stats['stale_hits']} stale, {stats['refreshes']} refreshed")
+        if entry is None:
+            return None
+        if time.time() - entry["fetched_at"] > TAVILY_CACHE_TTL:
+            with TavilyProvider._stats_lock:
+                TavilyProvider._stale_hits += 1
+                refresh = key not in TavilyProvider._refreshing
+                TavilyProvider._refreshing.add(key)
+            if refresh:
+                TavilyProvider._refresher.submit(self._refresh, key, topic, search_depth, max_tokens)
+        return entry["context"]
+
+    def _refresh(self, key, topic, search_depth, max_tokens):
+        try:
+            self._fetch_and_store(key, topic, search_depth, max_tokens)
+            with TavilyProvider._stats_lock:
+                TavilyProvider._refreshes += 1
+        except Exception as e:
+            # The stale context keeps being served until a refresh succeeds or it expires.
+            print(f"Error refreshing Tavily context for {topic}: {e}")
+        finally:
+            with TavilyProvider._stats_lock:
+                TavilyProvider._refreshing.discard(key)
+
+    def _fetch_and_store(self, key, topic, search_depth, max_tokens):
+        context = self._search_context(topic, search_depth, max_tokens)
+        # A missing context would be served as a hit for days; leave it to the next request to try again.
+        if context is not None:
+            TAVILY_CACHE.set(key, {"context": context, "fetched_at": time.time()})
+        return context
+
+    async def _afetch_and_store(self, key, topic, search_depth, max_tokens):
+        context = await self._asearch_context(topic, search_depth, max_tokens)
+        if context is not None:
+            await asyncio.to_thread(TAVILY_CACHE.set, key, {"context": context, "fetched_at": time.time()})
+        return context
 
     def search_context(self, topic, search_depth="advanced", max_tokens=4000):
-        search_results = self.tavily_client.get_search_context(topic, search_depth=search_depth, max_tokens=max_tokens)
-        return search_results
-    
+        key = TavilyProvider.cache_key(topic, search_depth, max_tokens)
+        context = self._cached_context(key, topic, search_depth, max_tokens)
+        if context is not None:
+            return context
+        return TavilyProvider._in_flight.do(key, self._fetch_and_store, key, topic, search_depth, max_tokens)
+
     async def asearch_context(self, topic, search_depth="advanced", max_tokens=4000):
-        search_results = await self.async_tavily_client.get_search_context(topic, search_depth=search_depth, max_tokens=max_tokens)
-        return search_results
\ No newline at end of file
+        key = TavilyProvider.cache_key(topic, search_depth, max_tokens)
+        context = await asyncio.to_thread(self._cached_context, key, topic, search_depth, max_tokens)
+        if context is not None:
+            return context
+        return await TavilyProvider._in_flight.ado(key, self._afetch_and_store, key, topic, search_depth, max_tokens)
+
+    def _search_context(self, topic, search_depth, max_tokens):
+        # One lease per key in the pool, and at least one, so an empty pool raises from acquire() instead of
+        # returning nothing.
+        attempts = max(1, len(self.key_pool.keys))
+        for attempt in range(attempts):
+            try:
+                with self.key_pool.lease() as api_key:
+                    self.rate_limiter.acquire(api_key)
+                    return TavilyProvider.get_client(api_key).get_search_context(topic, search_depth=search_depth, max_tokens=max_tokens)
+            except Exception as e:
+                # A throttled key is benched by the pool, so the next lease lands on a different key.
+                if classify_error(e) != RATE_LIMIT or attempt == attempts - 1:
+                    raise
+    
+    async def _asearch_context(self, topic, search_depth, max_tokens):
+        attempts = max(1, len(self.key_pool.keys))
+        for attempt in range(attempts):
+            try:
+                with self.key_pool.lease() as api_key:
+                    await self.rate_limiter.aacquire(api_key)
+                    return await TavilyProvider.get_async_client(api_key).get_search_context(topic, search_depth=search_depth, max_tokens=max_tokens)
+            except Exception as e:
+                if classify_error(e) != RATE_LIMIT or attempt == attempts - 1:
+                    raise
@@ -0,0 +1,163 @@
+import os
+import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from deep_translator import GoogleTranslator
+from api.response_cache import CACHE_DIRECTORY, MemoryCache
+from api.storage import connect, init_database, select_in
+
+load_dotenv()
+TRANSLATION_MAX_WORKERS = int(os.getenv("TRANSLATION_MAX_WORKERS", "4"))
+# Google's endpoint takes up to 5000 characters per request; leave room for the separators.
+TRANSLATION_MAX_CHARS = int(os.getenv("TRANSLATION_MAX_CHARS", "4500"))
+SEGMENT_SEPARATOR = "\n%%%\n"
+SEGMENT_SEPARATOR_PATTERN = re.compile(r"\s*%\s*%\s*%\s*")
+# Segments with no letters in any script (numbers, punctuation, whitespace) come back unchanged.
+HAS_LETTERS = re.compile(r"[^\W\d_]")
+TRANSLATION_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", os.path.join(CACHE_DIRECTORY, "translation-memory.sqlite3"))
+TRANSLATION_MEMORY_ENTRIES = int(os.getenv("TRANSLATION_MEMORY_ENTRIES", "20000"))
+
+
+class TranslationMemory:
+    """Every translation made, keyed by a hash of the source text and the target language, in SQLite (shared by
+    all worker processes on the host) behind an in-process LRU. Entries never expire: a segment is translated
+    once per language."""
+    def __init__(self, path=TRANSLATION_MEMORY_PATH, memory_entries=TRANSLATION_MEMORY_ENTRIES):
+        self.path = path
+        self.memory = MemoryCache(max_entries=memory_entries)
+        self._language_codes = None
+        self._language_codes_lock = threading.Lock()
+        init_database(path, "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT NOT NULL)")
+
+    def language_code(self, language):
+        """Routes pass both names ("hindi", "english") and codes ("hi", "en"); both map to the same entries."""
+        language = str(language).lower()
+        with self._language_codes_lock:
+            if self._language_codes is None:
+                try:
+                    self._language_codes = GoogleTranslator(source='auto', target='en').get_supported_languages(as_dict=True)
+                except Exception as e:
+                    print(f"Could not load the supported language list: {e}")
+                    return language
+        return self._language_codes.get(language, language)
+
+    def key(self, text, target_language):
+        return hashlib.sha256(f"{self.language_code(target_language)}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            entry = self.memory.get(key)
+            if entry is None:
+                missing.append(key)
+            else:
+                found[key] = entry[0]
+        if missing:
+            with connect(self.path) as conn:
+                for key, translation in select_in(conn, "SELECT key, translation FROM translations WHERE key IN ({placeholders})", missing):
+                    found[key] = translation
+                    self.memory.set(key, translation)
+        return found
+
+    def set_many(self, items):
+        items = list(items)
+        with connect(self.path) as conn:
+            conn.executemany("INSERT OR REPLACE INTO translations (key, translation) VALUES (?, ?)", items)
+        for key, translation in items:
+            self.memory.set(key, translation)
+
+
+class TranslationEngine:
+    """Translates nested content (dicts, lists, strings) in as few requests as possible. The structure is
+    flattened into text segments; unique segments are packed into requests of up to TRANSLATION_MAX_CHARS,
+    joined by a separator, with up to TRANSLATION_MAX_WORKERS requests in flight; the translations are put
+    back into the original shape. A request whose separators do not survive translation is redone one
+    segment at a time. Segments found in the translation memory are not sent at all."""
+    def __init__(self, max_workers=TRANSLATION_MAX_WORKERS, max_chars=TRANSLATION_MAX_CHARS, memory=None):
+        self.max_workers = max(1, max_workers)
+        self.max_chars = max_chars
+        self.memory = memory if memory is not None else TranslationMemory()
+
+    def _chunks(self, segments):
+        chunk = []
+        size = 0
+        for segment in segments:
+            if chunk and size + len(SEGMENT_SEPARATOR) + len(segment) > self.max_chars:
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(segment)
+            size += len(SEGMENT_SEPARATOR) + len(segment)
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _translate_chunk(chunk, target_language, source):
+        translator = GoogleTranslator(source=source, target=target_language)
+        if len(chunk) > 1:
+            translated = translator.translate(SEGMENT_SEPARATOR.join(chunk))
+            parts = SEGMENT_SEPARATOR_PATTERN.split(translated.strip()) if translated else []
+            if len(parts) == len(chunk):
+                return parts
+            print(f"Batched translation returned {len(parts)} segments for {len(chunk)}; translating them one by one")
+        return [translator.translate(segment) or segment for segment in chunk]
+
+    def translate_batch(self, texts, target_language, source='auto'):
+        """Translations of texts, in order."""
+        texts = [str(text) for text in texts]
+        unique = list(dict.fromkeys(text for text in texts if HAS_LETTERS.search(text)))
+        keys = {text: self.memory.key(text, target_language) for text in unique}
+        remembered = self.memory.get_many(list(keys.values()))
+        translations = {text: remembered[key] for text, key in keys.items() if key in remembered}
+        missing = [text for text in unique if text not in translations]
+        if missing:
+            chunks = list(self._chunks(missing))
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+                results = executor.map(lambda chunk: TranslationEngine._translate_chunk(chunk, target_language, source), chunks)
+                for chunk, translated in zip(chunks, results):
+                    translations.update(zip(chunk, translated))
+            self.memory.set_many((keys[text], translations[text]) for text in missing)
+        print(f"Translated {len(texts)} segments to {target_language}, {len(missing)} not in the translation memory")
+        return [translations.get(text, text) for text in texts]
+
+    def translate(self, text, target_language, source='auto'):
+        return self.translate_batch([text], target_language, source)[0]
+
+    def translate_structure(self, data, target_language, source='auto', translate_keys=False, skip_keys=()):
+        """data with every leaf replaced by the translation of str(leaf). Dict keys are translated too when
+        translate_keys is set; values under skip_keys are left as they are."""
+        segments = []
+
+        def collect(node):
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    if translate_keys:
+                        segments.append(str(key))
+                    if key not in skip_keys:
+                        collect(value)
+            elif isinstance(node, (list, tuple)):
+                for item in node:
+                    collect(item)
+            else:
+                segments.append(str(node))
+
+        collect(data)
+        translations = dict(zip(segments, self.translate_batch(segments, target_language, source)))
+
+        def rebuild(node):
+            if isinstance(node, dict):
+                return {
+                    (translations[str(key)] if translate_keys else key): (value if key in skip_keys else rebuild(value))
+                    for key, value in node.items()
+                }
+            if isinstance(node, (list, tuple)):
+                return [rebuild(item) for item in node]
+            return translations[str(node)]
+
+        return rebuild(data)
+
+
+TRANSLATION_ENGINE = TranslationEngine()
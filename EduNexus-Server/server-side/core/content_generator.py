@@ -1,27 +1,26 @@
-import time
-
 import PIL.Image
 from api.gemini_client import GeminiProvider
 from api.tavily_client import TavilyProvider
 
+# Keys every generated submodule must have; responses without them are regenerated rather than cached.
+CONTENT_KEYS = ("title_for_the_content", "content")
+
 class ContentGenerator:
     def __init__(self):
         self.gemini_client = GeminiProvider()
 
-    def generate_content(self, sub_modules : dict, module_name, course_name, api_key_to_use):
+    def generate_content(self, sub_modules : dict, module_name, course_name):
         prompt_content_gen = """I'm seeking your expertise on the sub-module : {sub_module_name} which comes under the module: {module_name}. This module is a part of the course: {course_name}. As a knowledgeable educational assistant, I trust in your ability to provide a comprehensive explanation of this sub-module. Think about the sub-module step by step and design the best way to explain the sub-module to a student. Your response should cover essential aspects such as definition, in-depth examples, and any details crucial for understanding the topic. Please generate quality content on the sub-module ensuring the response is sufficiently detailed covering all the relevant topics related to the sub-module. In your response, organize the information into subsections for clarity and elaborate on each subsection with suitable examples if and only if it is necessary. Include specific hypothetical scenario-based examples(only if it is necessary) or important sub-sections related to the subject to enhance practical understanding. If applicable, incorporate real-world examples, applications or use-cases to illustrate the relevance of the topic in various contexts. Additionally, incorporate anything that helps the student to better understand the topic. Ensure all the relevant aspects and topics related to the sub-module is covered in your response. Conclude your response by suggesting relevant URLs for further reading to empower users with additional resources on the subject. Please format your output as valid JSON, with the following keys: title_for_the_content (suitable title for the sub-module), content(an introduction of the sub-module), subsections (a list of dictionaries with keys - title and content), and urls (a list). Be a good educational assistant and craft the best way to explain the sub-module.Strictly, ensure that output shouldn't have any syntax errors and the given format is followed"""
         all_content = []
-        flag = 1 if api_key_to_use== 'first' else (2 if api_key_to_use=='second' else 3 )
-        print(f'THREAD {flag} RUNNING...')
         for key,val in sub_modules.items():
-            content_output = self.gemini_client.generate_json_response(prompt_content_gen.format(sub_module_name = val, module_name = module_name, course_name=course_name))
+            content_output = self.gemini_client.generate_json_response(prompt_content_gen.format(sub_module_name = val, module_name = module_name, course_name=course_name), expected_type=dict, required_keys=CONTENT_KEYS)
             print("Thread 1: Module Generated: ",key,"!")   
             content_output['subject_name'] = val
             print(content_output)
             all_content.append(content_output)
         return all_content
     
-    def generate_content_with_profile(self, sub_modules : dict, module_name, course_name, lesson_type, profile, api_key_to_use):
+    def generate_content_with_profile(self, sub_modules : dict, module_name, course_name, lesson_type, profile):
         theoretical_prompt = """I'm seeking your expertise on the sub-module : {sub_module_name} which comes under the module: {module_name}. This module is a part of the course: {course_name}. As a knowledgeable educational assistant, I trust in your ability to provide a comprehensive explanation of this sub-module. Think about the sub-module step by step and design the best way to explain the sub-module to a student.  You will also be provided with my course requirements and needs inside <INSTRUCTIONS>. Structure the course according to my needs.\n<INSTRUCTIONS>\nMY COURSE REQUIREMENTS : {profile}\n</INSTRUCTIONS>\n\nYour response should cover essential aspects such as definition, in-depth examples, and any details crucial for understanding the topic. Please generate quality content on the sub-module ensuring the response is sufficiently detailed covering all the relevant topics related to the sub-module. In your response, organize the information into subsections for clarity and elaborate on each subsection with suitable examples if and only if it is necessary. Include specific hypothetical scenario-based examples(only if it is necessary) or important sub-sections related to the subject to enhance practical understanding. If applicable, incorporate real-world examples, applications or use-cases to illustrate the relevance of the topic in various contexts. Additionally, incorporate anything that helps the student to better understand the topic. Ensure all the relevant aspects and topics related to the sub-module is covered in your response. Conclude your response by suggesting relevant URLs for further reading to empower users with additional resources on the subject. Please format your output as valid JSON, with the following keys: title_for_the_content (suitable title for the sub-module), content(an introduction of the sub-module), subsections (a list of dictionaries with keys - title and content), and urls (a list). Be a good educational assistant and craft the best way to explain the sub-module.Strictly, ensure that output shouldn't have any syntax errors and the given format is followed"""
 
         math_prompt = """I'm seeking your expertise on the mathematical sub-module: {sub_module_name} which comes under the module: {module_name}. This module is a part of the course: {course_name}. As a knowledgeable mathematical assistant, I trust in your ability to provide a clear, structured, and comprehensive explanation of this sub-module. Think about the mathematical concepts step by step and develop the best method to explain this sub-module to a student. You will also be provided with my course requirements and needs inside <INSTRUCTIONS>. Structure the course according to my needs.\n<INSTRUCTIONS>\nMY COURSE REQUIREMENTS : {profile}\n</INSTRUCTIONS>\n\nYour response should address key aspects such as definitions, theorems, proofs, and practical problem-solving techniques. Break down complex topics into simpler parts, using appropriate notations and step-by-step calculations. Structure the content into well-defined sections that focus on conceptual understanding, followed by real-world applications if applicable. Where necessary, provide equations or solved problems to teach me. Include hypothetical or practical examples, illustrating the application of mathematical principles through problem-solving exercises. Offer detailed explanations of the solutions, emphasizing core methodologies and any common pitfalls. Ensure the response is sufficiently detailed, covering all essential mathematical concepts and related sub-topics. Conclude by suggesting relevant URLs for further exploration, enabling users to expand their knowledge. Format the output as valid JSON, with the following keys: title_for_the_content (suitable title for the sub-module), content (an introduction of the sub-module), subsections (a list of dictionaries with keys - title and content), and urls (a list). Ensure that the output adheres strictly to the given format and does not contain any syntax errors."""
@@ -35,36 +34,31 @@ class ContentGenerator:
         else:
             prompt = theoretical_prompt    
         all_content = []
-        flag = 1 if api_key_to_use== 'first' else (2 if api_key_to_use=='second' else 3 )
-        print(f'THREAD {flag} RUNNING...')
         for key,val in sub_modules.items():
-            content_output = self.gemini_client.generate_json_response(prompt.format(sub_module_name = val, module_name = module_name, course_name=course_name, profile=profile))
+            content_output = self.gemini_client.generate_json_response(prompt.format(sub_module_name = val, module_name = module_name, course_name=course_name, profile=profile), expected_type=dict, required_keys=CONTENT_KEYS)
             print("Thread 1: Module Generated: ",key,"!")   
             content_output['subject_name'] = val
             print(content_output)
             all_content.append(content_output)
         return all_content
     
-    def generate_content_from_web(self, sub_modules: dict, module_name, course_name, api_key_to_use):
+    def generate_content_from_web(self, sub_modules: dict, module_name, course_name):
         content_generation_prompt = """I'm seeking your expertise on the subject of {sub_module_name}, which falls under the module: {module_name}. This module is a part of the course: {course_name}. As a knowledgeable educational assistant, you must provide a response in strictly formatted JSON.\n\nYour response should cover key aspects such as definitions, in-depth examples, and essential details to ensure a comprehensive understanding. This content must be structured specifically for educational purposes.\n\n**IMPORTANT**:\n1. Your response must **strictly adhere to JSON format** as shown below.\n2. Ensure that the output includes all required fields as JSON keys: `title_for_the_content`, `content`, `subsections`, and `urls`.\n3. Each `subsection` should be structured with `title` and `content` fields only.\n\nCONTENT GENERATION :\nUsing the subject information provided, generate detailed and informative content for the sub-module. Cover essential aspects such as definitions, real-world examples, and relevant applications. If helpful, use hypothetical scenarios to enhance practical understanding.\n\nSUBJECT INFORMATION:\n```{search_result}```\n--------------------------------\n<INSTRUCTIONS>\n- Organize the information into subsections for clarity and elaborate on each subsection with suitable examples if and only if it is necessary. \n- Include specific hypothetical scenario-based examples (only if it is necessary) or important sub-sections related to the subject to enhance practical understanding. \n- If applicable, incorporate real-world examples, applications or use-cases to illustrate the relevance of the topic in various contexts. Additionally, incorporate anything that helps the student to better understand the topic. \n- Ensure all the relevant aspects and topics related to the sub-module is covered in your response. \n- Conclude your response by suggesting relevant URLs for further reading to empower users with additional resources on the subject.\n- Format your output as valid JSON, with the following keys: title_for_the_content (suitable title for the sub-module), content(an introduction of the sub-module), subsections (a list of dictionaries with keys - title and content), and urls (a list). Follow the JSON format precisely, and ensure it is valid.\n</INSTRUCTIONS>\nYour JSON response should strictly follow the format given above. Failure to follow the exact JSON format will result in invalid output."""
-        flag = 1 if api_key_to_use== 'first' else (2 if api_key_to_use=='second' else 3 )
-        print(f'THREAD {flag} RUNNING...')
-        tavily_client = TavilyProvider(flag)        
+        tavily_client = TavilyProvider()
         all_content = []
         for key, val in sub_modules.items():    
             topic = course_name + "-" + module_name + " : " + val
             print('Searching content for module:', topic)
             search_result = tavily_client.search_context(topic)
-            output = self.gemini_client.generate_json_response(content_generation_prompt.format(sub_module_name = val, search_result = search_result, module_name=module_name, course_name=course_name))
+            output = self.gemini_client.generate_json_response(content_generation_prompt.format(sub_module_name = val, search_result = search_result, module_name=module_name, course_name=course_name), expected_type=dict, required_keys=CONTENT_KEYS)
             print('Module Generated:', key, '!')
             output['subject_name'] = val
             print(output)
             all_content.append(output)
-            time.sleep(3)
 
         return all_content
     
-    def generate_content_from_web_with_profile(self, sub_modules: dict, module_name, course_name, lesson_type, profile, api_key_to_use):
+    def generate_content_from_web_with_profile(self, sub_modules: dict, module_name, course_name, lesson_type, profile):
         theoretical_prompt = """I'm seeking your expertise on the subject of {sub_module_name}, which falls under the module: {module_name}. This module is a part of the course: {course_name}. As a knowledgeable educational assistant, you must provide a response in strictly formatted JSON.\n\nYour response should cover key aspects such as definitions, in-depth examples, and essential details to ensure a comprehensive understanding. This content must be structured specifically for educational purposes.\n\n**IMPORTANT**:\n1. Your response must **strictly adhere to JSON format** as shown below.\n2. Ensure that the output includes all required fields as JSON keys: `title_for_the_content`, `content`, `subsections`, and `urls`.\n3. Each `subsection` should be structured with `title` and `content` fields only.\n\nCONTENT GENERATION :\nUsing the subject information provided, generate detailed and informative content for the sub-module. Cover essential aspects such as definitions, real-world examples, and relevant applications. If helpful, use hypothetical scenarios to enhance practical understanding.\n\nSUBJECT INFORMATION:\n```{search_result}```\n--------------------------------\n<INSTRUCTIONS>\n- Organize the information into subsections for clarity and elaborate on each subsection with suitable examples if and only if it is necessary. \n- Include specific hypothetical scenario-based examples (only if it is necessary) or important sub-sections related to the subject to enhance practical understanding. \n- If applicable, incorporate real-world examples, applications or use-cases to illustrate the relevance of the topic in various contexts. Additionally, incorporate anything that helps the student to better understand the topic. \n- Ensure all the relevant aspects and topics related to the sub-module is covered in your response. \n- Conclude your response by suggesting relevant URLs for further reading to empower users with additional resources on the subject.\n- Format your output as valid JSON, with the following keys: title_for_the_content (suitable title for the sub-module), content(an introduction of the sub-module), subsections (a list of dictionaries with keys - title and content), and urls (a list). Follow the JSON format precisely, and ensure it is valid.\n- Follow the course requirements so I can better understand the topic.\n**Course Requirements**:{profile}\n</INSTRUCTIONS>\nYour JSON response should strictly follow the format given above. Failure to follow the exact JSON format will result in invalid output."""
 
         math_prompt = """I'm seeking your expertise on the mathematical sub-module: {sub_module_name}, which falls under the module: {module_name}. This module is part of the course: {course_name}. As a knowledgeable educational assistant, you must provide a response in strictly formatted JSON.  
@@ -141,24 +135,21 @@ Your JSON response must strictly adhere to the format and structure given above.
             prompt = technical_prompt
         else:
             prompt = theoretical_prompt 
-        flag = 1 if api_key_to_use== 'first' else (2 if api_key_to_use=='second' else 3 )
-        print(f'THREAD {flag} RUNNING...')
-        tavily_client = TavilyProvider(flag)        
+        tavily_client = TavilyProvider()
         all_content = []
         for key, val in sub_modules.items():    
             topic = course_name + "-" + module_name + " : " + val
             print('Searching content for module:', topic)
             search_result = tavily_client.search_context(topic)
-            output = self.gemini_client.generate_json_response(prompt.format(sub_module_name = val, search_result = search_result, module_name=module_name, course_name=course_name, profile=profile))
+            output = self.gemini_client.generate_json_response(prompt.format(sub_module_name = val, search_result = search_result, module_name=module_name, course_name=course_name, profile=profile), expected_type=dict, required_keys=CONTENT_KEYS)
             print('Module Generated:', key, '!')
             output['subject_name'] = val
             print(output)
             all_content.append(output)
-            time.sleep(3)
 
         return all_content
     
-    def generate_content_from_textbook(self, course_name, module_name, output:dict, profile, vectordb, api_key_to_use):
+    def generate_content_from_textbook(self, course_name, module_name, output:dict, profile, vectordb):
         prompt= """I'm seeking your expertise on the subject of {sub_module_name} which comes under the module: {module_name}. This module is a part of the course: {course_name}. As a knowledgeable educational assistant, I trust in your ability to provide a comprehensive explanation of this sub-module. Think about the sub-module step by step and design the best way to explain the sub-module to me. Your response should cover essential aspects such as definition, in-depth examples, and any details crucial for understanding the topic. You have access to the subject's information which you have to use while generating the educational content. Please generate quality content on the sub-module ensuring the response is sufficiently detailed covering all the relevant topics related to the sub-module. You will also be provided with my course requirements and needs inside <INSTRUCTIONS>. Structure the course according to my needs.
     
     SUBJECT INFORMATION : ```{context}```
@@ -172,13 +163,11 @@ Your JSON response must strictly adhere to the format and structure given above.
     """
 
         all_content = []
-        flag = 1 if api_key_to_use== 'first' else (2 if api_key_to_use=='second' else 3 )
-        print(f'THREAD {flag} RUNNING...')
         for key,val in output.items():
             relevant_docs = vectordb.similarity_search(val)
             rel_docs = [doc.page_content for doc in relevant_docs]
             context = '\n'.join(rel_docs)
-            content_output = self.gemini_client.generate_json_response(prompt.format(sub_module_name = val, module_name = module_name, profile= profile, context=context, course_name=course_name))
+            content_output = self.gemini_client.generate_json_response(prompt.format(sub_module_name = val, module_name = module_name, profile= profile, context=context, course_name=course_name), expected_type=dict, required_keys=CONTENT_KEYS)
             print("Thread 1: Module Generated: ",key,"!")   
             content_output['subject_name'] = val
             print(content_output)
@@ -200,7 +189,7 @@ Technical Breakdown: If the image involves technical or specialized content (e.g
 Logical Flow: Ensure your explanation is organized and flows logically to make it easier for another model to use this analysis to explain the broader topic effectively.
 
 Provide as much detail as possible and aim to enrich the understanding of the images in the context of the topic. Explain both the images separately. Here are the two images:"""
-        output = self.gemini_client.explain_two_image(prompt=prompt, image1_path=images[0], image2_path=images[1])
+        output = await self.gemini_client.aexplain_two_image(prompt=prompt, image1_path=images[0], image2_path=images[1])
         return output
     
     async def generate_content_from_textbook_and_images(self, course_name, module_name, lesson_type, submodule_name, profile, context, image_explanation):
@@ -281,7 +270,7 @@ Strictly follow the output format provided above. The response must be technical
         else:    
             prompt = theoretical_prompt
 
-        content_output = self.gemini_client.generate_json_response(prompt) 
+        content_output = await self.gemini_client.agenerate_json_response(prompt, expected_type=dict, required_keys=CONTENT_KEYS) 
         content_output['subject_name'] = submodule_name
         print(content_output)
 
@@ -351,7 +340,7 @@ Ensure your response is detailed, technically rigorous, and strictly follows the
             prompt = technical_prompt
         else:    
             prompt = theoretical_prompt
-        content_output = self.gemini_client.generate_json_response(prompt) 
+        content_output = await self.gemini_client.agenerate_json_response(prompt, expected_type=dict, required_keys=CONTENT_KEYS) 
         content_output['subject_name'] = submodule_name
         print(content_output)
 
@@ -451,7 +440,7 @@ Ensure your response is technically rigorous, and strictly follow the output for
             prompt = technical_prompt
         else:
             prompt = theoretical_prompt
-        content_output = self.gemini_client.generate_json_response(prompt) 
+        content_output = await self.gemini_client.agenerate_json_response(prompt, expected_type=dict, required_keys=CONTENT_KEYS) 
         content_output['subject_name'] = submodule_name
         print(content_output)
 
@@ -542,7 +531,7 @@ Ensure your response is detailed, technically accurate, and adheres strictly to
         else:
             prompt = theoretical_prompt
 
-        content_output = self.gemini_client.generate_json_response(prompt)
+        content_output = await self.gemini_client.agenerate_json_response(prompt, expected_type=dict, required_keys=CONTENT_KEYS)
         content_output['subject_name'] = submodule_name
         print(content_output)
 
@@ -1,15 +1,28 @@
-from models.data_loader import DocumentLoader
-from models.data_utils import DocumentUtils
+from models.data_loader import DocumentLoader, CLIP_EMBEDDING_DIMENSION
+from models.data_utils import DocumentUtils, ImageFilter
+from models.index_registry import INDEX_REGISTRY, IndexRegistry
+from models.index_manifest import IndexManifest, MANIFEST_FILENAME
+from models.index_factory import IndexFactory
 from api.serper_client import SerperProvider
 from api.tavily_client import TavilyProvider
 from core.content_generator import ContentGenerator
-from langchain_community.vectorstores.faiss import FAISS
+from core.scheduler import SubmoduleScheduler
+from dotenv import load_dotenv
 import faiss
+import numpy as np
 import os
+import uuid
+import hashlib
 import asyncio
 from pykka import ThreadingActor
-from concurrent.futures import ThreadPoolExecutor
-from pykka import ThreadingActor
+
+load_dotenv()
+INCREMENTAL_INDEXING = os.getenv("INCREMENTAL_INDEXING", "true").lower() == "true"
+IMAGE_TOMBSTONE_COMPACTION_RATIO = float(os.getenv("IMAGE_TOMBSTONE_COMPACTION_RATIO", "0.3"))
+IMAGE_SEARCH_TOP_K = int(os.getenv("IMAGE_SEARCH_TOP_K", "10"))
+# "topk" keeps the IMAGE_SEARCH_TOP_K best images over the similarity threshold; "range" keeps every image over
+# the threshold, as retrieval did before top-k search, using a range search instead of scoring the whole index.
+IMAGE_SEARCH_MODE = os.getenv("IMAGE_SEARCH_MODE", "topk").lower()
 
 class ResultHandler(ThreadingActor):
     async def receive(self, message):
@@ -27,6 +40,7 @@ class SimpleRAG:
             chunk_size=1000,
             chunk_overlap=200,
             text_vectorstore_path=None,
+            index_type=None,
     ):
         if syllabus_directory_path is None:
             raise Exception("Syllabus pdf path must be provided")
@@ -34,18 +48,25 @@ class SimpleRAG:
         self.embeddings = embeddings
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.index_type = IndexFactory.resolve_type(index_type)
         self.current_dir = os.path.dirname(__file__)
         self.faiss_vectorstore_directory = os.path.join(self.current_dir, 'syllabus-vectorstore')
         os.makedirs(self.faiss_vectorstore_directory, exist_ok=True)
-        self.text_vectorstore_path = os.path.join(self.faiss_vectorstore_directory, course_name)
         if text_vectorstore_path is not None:
-            self.text_vectorstore = FAISS.load_local(text_vectorstore_path, embeddings=embeddings, allow_dangerous_deserialization=True)
+            self.text_vectorstore_path = text_vectorstore_path
+            self.text_vectorstore = INDEX_REGISTRY.get_text(text_vectorstore_path, embeddings)
         else:
+            content_hash = IndexRegistry.content_hash([syllabus_directory_path], extra=[chunk_size, chunk_overlap, getattr(embeddings, "model_name", None), self.index_type])
+            self.text_vectorstore_path = os.path.join(self.faiss_vectorstore_directory, IndexRegistry.namespace(course_name, content_hash))
             self.text_vectorstore = None
         
     async def create_text_vectorstore(self):
-        self.text_vectorstore = await DocumentLoader.create_faiss_vectorstore_for_text(documents_directory=self.syllabus_directory_path, embeddings=self.embeddings, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, input_type='pdf', links=[])
-        self.text_vectorstore.save_local(self.text_vectorstore_path)
+        if os.path.exists(self.text_vectorstore_path):
+            # Same syllabus and settings as an earlier upload; reuse that index.
+            self.text_vectorstore = INDEX_REGISTRY.get_text(self.text_vectorstore_path, self.embeddings)
+            return self.text_vectorstore_path
+        self.text_vectorstore = await DocumentLoader.create_faiss_vectorstore_for_text(documents_directory=self.syllabus_directory_path, embeddings=self.embeddings, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, input_type='pdf', links=[], index_type=self.index_type)
+        INDEX_REGISTRY.save_text(self.text_vectorstore_path, self.text_vectorstore)
         return self.text_vectorstore_path
     
     async def search_similar_text(self, query, k=5):
@@ -60,6 +81,7 @@ class MultiModalRAG:
             course_name=None,
             lesson_name=None,
             lesson_type=None,
+            owner_id=None,
             documents_directory_path=None, 
             embeddings=None, 
             clip_model=None, 
@@ -73,10 +95,12 @@ class MultiModalRAG:
             input_type=None,
             links=None,
             include_images=None,
+            index_type=None,
     ):
         self.course_name = course_name
         self.lesson_name = lesson_name
         self.lesson_type = lesson_type
+        self.owner_id = owner_id
         if documents_directory_path is None:
             raise Exception("Document Directory Path path must be provided")
         self.documents_directory_path = documents_directory_path
@@ -92,54 +116,243 @@ class MultiModalRAG:
         self.input_type = input_type
         self.links = links
 
+        self.include_images = include_images
+        self.index_type = IndexFactory.resolve_type(index_type)
+
         self.current_dir = os.path.dirname(__file__)
         self.faiss_vectorstore_directory = os.path.join(self.current_dir, 'faiss-vectorstore')
-        os.makedirs(self.faiss_vectorstore_directory, exist_ok=True)
-        self.image_directory_path = os.path.join(self.current_dir, 'extracted-images', lesson_name)
-        self.text_vectorstore_path = os.path.join(self.faiss_vectorstore_directory, 'text-faiss-index')
-        self.image_vectorstore_path = os.path.join(self.faiss_vectorstore_directory, 'image-faiss-index')
+        # Each owner/course/lesson/content combination gets its own directory holding the text index, the image
+        # index and the extracted images, so teachers working at the same time never overwrite each other's
+        # indexes, and an incremental update only ever starts from the same teacher's earlier index of the lesson.
+        if text_vectorstore_path is not None:
+            self.index_directory = os.path.dirname(text_vectorstore_path)
+        else:
+            content_hash = IndexRegistry.content_hash(
+                [documents_directory_path],
+                extra=[input_type, links, chunk_size, chunk_overlap, bool(include_images), getattr(embeddings, "model_name", None), self.index_type],
+            )
+            self.index_directory = os.path.join(self.faiss_vectorstore_directory, IndexRegistry.namespace(owner_id or 'shared', course_name, lesson_name, content_hash))
+        os.makedirs(self.index_directory, exist_ok=True)
+        self.image_directory_path = os.path.join(self.index_directory, 'images')
+        self.legacy_image_directory_path = os.path.join(self.current_dir, 'extracted-images', lesson_name or '')
+        self.text_vectorstore_path = os.path.join(self.index_directory, 'text-faiss-index')
+        self.image_vectorstore_path = os.path.join(self.index_directory, 'image-faiss-index')
         if text_vectorstore_path is not None:
-            self.text_vectorstore = FAISS.load_local(text_vectorstore_path, embeddings=embeddings, allow_dangerous_deserialization=True)
+            self.text_vectorstore = INDEX_REGISTRY.get_text(text_vectorstore_path, embeddings)
         else:
             self.text_vectorstore = None
         
-        if image_vectorstore_path is not None:
-            self.image_vectorstore = faiss.read_index(image_vectorstore_path)
+        if image_vectorstore_path is not None and os.path.exists(image_vectorstore_path):
+            self.image_vectorstore = INDEX_REGISTRY.get_image(image_vectorstore_path)
         else:
             self.image_vectorstore = None
-        
-        self.include_images = include_images
+        self.manifest = IndexManifest.load(self.index_directory)
+        self._image_paths = None
 
     async def create_text_and_image_vectorstores(self):
+        if self.manifest is not None and os.path.exists(self.text_vectorstore_path) and (not self.include_images or os.path.exists(self.image_vectorstore_path)):
+            # The same documents were indexed before with the same settings.
+            print("\nReusing existing vector databases for this content.\n")
+            self.text_vectorstore = INDEX_REGISTRY.get_text(self.text_vectorstore_path, self.embeddings)
+            if self.include_images:
+                self.image_vectorstore = INDEX_REGISTRY.get_image(self.image_vectorstore_path)
+            self._image_paths = None
+            return self.text_vectorstore_path, self.image_vectorstore_path
+
+        # Start from the newest index of this lesson built with the same settings, if there is one, so only
+        # documents and links that were added since then are processed.
+        base_directory = self._find_base_index() if INCREMENTAL_INDEXING else None
         result_handler = ResultHandler.start()
         try:
-            if self.include_images:
-                with ThreadPoolExecutor() as executor:
-                    tasks = [
-                        executor.submit(asyncio.run, DocumentLoader.create_faiss_vectorstore_for_text(self.documents_directory_path, self.embeddings, self.chunk_size, self.chunk_overlap, self.input_type, self.links)),
-                        executor.submit(asyncio.run, DocumentLoader.create_faiss_vectorstore_for_image(self.documents_directory_path, self.image_directory_path, self.clip_model, self.clip_processor, self.input_type, self.links)),
-                    ]
-                self.text_vectorstore = tasks[0].result()
-                self.image_vectorstore = tasks[1].result()
-                result_handler.tell((self.text_vectorstore, self.image_vectorstore))
-                faiss.write_index(self.image_vectorstore, self.image_vectorstore_path)
-            else:
-                self.text_vectorstore = await DocumentLoader.create_faiss_vectorstore_for_text(self.documents_directory_path, self.embeddings, self.chunk_size, self.chunk_overlap, self.input_type, self.links)
-                result_handler.tell("Text Vector store created")
+            await self._build_indexes(base_directory)
+            result_handler.tell("Text Vector store created")
         finally:
             result_handler.stop()
-            
-        self.text_vectorstore.save_local(self.text_vectorstore_path)
         return self.text_vectorstore_path, self.image_vectorstore_path
 
-    def search_image(self, query_text, image_paths):
+    def _index_settings(self):
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "include_images": bool(self.include_images),
+            "embeddings": getattr(self.embeddings, "model_name", None),
+            "index_type": self.index_type,
+        }
+
+    def _find_base_index(self):
+        lesson_directory = os.path.dirname(self.index_directory)
+        settings = self._index_settings()
+        candidates = []
+        for name in os.listdir(lesson_directory):
+            directory = os.path.join(lesson_directory, name)
+            manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+            if directory == self.index_directory or not os.path.exists(manifest_path):
+                continue
+            if not os.path.exists(os.path.join(directory, 'text-faiss-index')):
+                continue
+            if self.include_images and not os.path.exists(os.path.join(directory, 'image-faiss-index')):
+                continue
+            if IndexManifest.load(directory).settings == settings:
+                candidates.append((os.path.getmtime(manifest_path), directory))
+        return max(candidates)[1] if candidates else None
+
+    async def _build_indexes(self, base_directory=None):
+        sources = await asyncio.to_thread(DocumentLoader.list_sources, self.documents_directory_path, self.input_type, self.links)
+        manifest = IndexManifest.load(base_directory) if base_directory is not None else None
+        if manifest is not None:
+            print(f"\nUpdating vector databases from {base_directory}...\n")
+            # Private copies: the registry's instances of the base index may be serving other requests.
+            text_vectorstore = await asyncio.to_thread(IndexRegistry.load_text, os.path.join(base_directory, 'text-faiss-index'), self.embeddings)
+            image_vectorstore = await asyncio.to_thread(IndexRegistry.load_image, os.path.join(base_directory, 'image-faiss-index')) if self.include_images else None
+            if manifest.diff(sources)[1] and not (IndexFactory.is_flat(text_vectorstore.index) and (image_vectorstore is None or IndexFactory.is_flat(image_vectorstore))):
+                # HNSW cannot remove vectors and IVF does not renumber the rows that remain, so a source can only
+                # be dropped from a flat index. Text embeddings come from the embedding cache, so rebuilding is cheap.
+                print("Sources were removed from an approximate index; rebuilding it.")
+                manifest = None
+        if manifest is None:
+            print("\nCreating vector databases...\n")
+            manifest = IndexManifest(settings=self._index_settings())
+            text_vectorstore = None
+            image_vectorstore = None
+
+        added, removed = manifest.diff(sources)
+        print(f"{len(added)} new source(s), {len(removed)} removed, {len(sources) - len(added)} unchanged")
+        removed_text_ids = [text_id for source_id in removed for text_id in manifest.remove_source(source_id)]
+        if removed_text_ids:
+            text_vectorstore.delete(removed_text_ids)
+        for source_id in added:
+            manifest.sources[source_id] = {"location": sources[source_id][1], "text_ids": [], "image_rows": []}
+
+        async def add_texts():
+            nonlocal text_vectorstore
+            source_texts = await asyncio.gather(*[DocumentLoader.load_source_texts(sources[source_id], self.chunk_size, self.chunk_overlap) for source_id in added])
+            texts = []
+            ids = []
+            for source_id, new_texts in zip(added, source_texts):
+                new_ids = [str(uuid.uuid4()) for _ in new_texts]
+                manifest.sources[source_id]["text_ids"] = new_ids
+                texts.extend(new_texts)
+                ids.extend(new_ids)
+            if text_vectorstore is None:
+                if not texts:
+                    raise Exception("No text could be extracted from the provided documents or links")
+                text_vectorstore = await IndexFactory.build_text_vectorstore(texts, self.embeddings, ids=ids, index_type=self.index_type)
+            elif texts:
+                await text_vectorstore.aadd_texts(texts, ids=ids)
+                text_vectorstore.index = IndexFactory.upgrade(text_vectorstore.index, self.index_type)
+
+        async def add_images():
+            nonlocal image_vectorstore
+            source_images = await asyncio.gather(*[
+                DocumentLoader.extract_source_images(sources[source_id], os.path.join(self.image_directory_path, hashlib.sha256(source_id.encode("utf-8")).hexdigest()[:16]))
+                for source_id in added
+            ])
+            # Hashes of the figures already in the index, so copies of them in new documents are dropped too.
+            # Sources are filtered one after another, so a figure repeated across documents is kept only once.
+            seen_hashes = await asyncio.to_thread(ImageFilter.hashes, [path for path in manifest.image_paths if path is not None])
+            source_images = [await asyncio.to_thread(ImageFilter.filter_images, image_paths, seen_hashes) for image_paths in source_images]
+            new_embeddings = []
+            for source_id, image_paths in zip(added, source_images):
+                if not image_paths:
+                    continue
+                new_embeddings.append(await asyncio.to_thread(DocumentLoader.embed_images, image_paths, self.clip_model, self.clip_processor))
+                # image_paths stays aligned with the rows of the image index.
+                first_row = len(manifest.image_paths)
+                manifest.sources[source_id]["image_rows"] = list(range(first_row, first_row + len(image_paths)))
+                manifest.image_paths.extend(image_paths)
+            new_embeddings = np.vstack(new_embeddings) if new_embeddings else np.zeros((0, CLIP_EMBEDDING_DIMENSION), dtype="float32")
+            if image_vectorstore is None:
+                image_vectorstore = IndexFactory.build(new_embeddings, self.index_type, faiss.METRIC_INNER_PRODUCT)
+            elif manifest.tombstone_ratio() > IMAGE_TOMBSTONE_COMPACTION_RATIO:
+                # The rebuilt index covers every live image, the ones just embedded included.
+                image_vectorstore = await asyncio.to_thread(self._compact_image_index, manifest)
+            else:
+                image_vectorstore.add(new_embeddings)
+                image_vectorstore = IndexFactory.upgrade(image_vectorstore, self.index_type)
+
+        if self.include_images:
+            await asyncio.gather(add_texts(), add_images())
+        else:
+            await add_texts()
+
+        self.text_vectorstore = text_vectorstore
+        self.image_vectorstore = image_vectorstore
+        INDEX_REGISTRY.save_text(self.text_vectorstore_path, self.text_vectorstore)
+        if self.include_images:
+            INDEX_REGISTRY.save_image(self.image_vectorstore_path, self.image_vectorstore)
+        # Written last: a directory only counts as a complete index (and a base for later updates) once it has a manifest.
+        manifest.save(self.index_directory)
+        self.manifest = manifest
+        self._image_paths = None
+
+    def _compact_image_index(self, manifest):
+        live_rows = [row for row, path in enumerate(manifest.image_paths) if path is not None]
+        # Vectors come from the CLIP embedding cache, not the index: IVF and PQ indexes cannot hand back their
+        # vectors without a direct map, and PQ would only return lossy reconstructions.
+        vectors = DocumentLoader.embed_images([manifest.image_paths[row] for row in live_rows], self.clip_model, self.clip_processor)
+        compacted = IndexFactory.build(vectors, self.index_type, faiss.METRIC_INNER_PRODUCT)
+        new_rows = {old_row: new_row for new_row, old_row in enumerate(live_rows)}
+        for entry in manifest.sources.values():
+            entry["image_rows"] = [new_rows[row] for row in entry["image_rows"]]
+        manifest.image_paths = [manifest.image_paths[row] for row in live_rows]
+        print(f"Compacted image index to {len(live_rows)} images")
+        return compacted
+
+    def indexed_image_paths(self):
+        """Image paths aligned with the rows of the image index (the row -> path mapping persisted in the
+        manifest next to the index); tombstoned rows are None. Resolved once per index, not per search."""
+        if self._image_paths is None:
+            if self.manifest is not None:
+                image_paths = self.manifest.image_paths
+            else:
+                # Indexes built before manifests existed were built in directory walk order, from the images
+                # extracted to the shared per-lesson directory used at the time.
+                image_paths = DocumentLoader.list_images(self.legacy_image_directory_path)
+            self._image_paths = (image_paths, sum(path is not None for path in image_paths))
+        return self._image_paths[0]
+
+    def image_count(self):
+        self.indexed_image_paths()
+        return self._image_paths[1]
+
+    def _image_results(self, scores, rows, threshold):
+        image_paths = self.indexed_image_paths()
+        # Rows of removed documents are tombstoned (None) until the index is compacted.
+        return [image_paths[row] for score, row in zip(scores, rows) if 0 <= row < len(image_paths) and image_paths[row] is not None and score >= threshold]
+
+    def search_image(self, query_text, k=IMAGE_SEARCH_TOP_K, threshold=None):
+        """The k images most similar to query_text, best first, keeping only those scoring at least threshold
+        (image_similarity_threshold by default)."""
+        threshold = self.image_similarity_threshold if threshold is None else threshold
         query_image_embeddings = DocumentUtils.embed_text_with_clip(text=query_text, clip_model=self.clip_model, clip_tokenizer=self.clip_tokenizer)
-        dist, indx = self.image_vectorstore.search(query_image_embeddings, k=len(image_paths))
-        distances = dist[0]
-        indexes = indx[0]
-        sorted_images = [image_paths[idx] for idx in indexes]
-        top_k_images = [sorted_images[i] for i in range(len(indexes)) if distances[i]>= self.image_similarity_threshold]
-        return top_k_images
+        # Ask for enough extra rows that tombstoned hits cannot crowd out live ones.
+        tombstones = len(self.indexed_image_paths()) - self.image_count()
+        search_k = min(k + tombstones, self.image_vectorstore.ntotal)
+        if search_k == 0:
+            return []
+        scores, rows = self.image_vectorstore.search(query_image_embeddings, k=search_k)
+        return self._image_results(scores[0], rows[0], threshold)[:k]
+
+    def _range_results(self, query_image_embeddings, threshold):
+        # range_search keeps inner products strictly above the radius.
+        limits, scores, rows = self.image_vectorstore.range_search(query_image_embeddings, threshold - 1e-6)
+        results = []
+        for start, end in zip(limits[:-1], limits[1:]):
+            order = np.argsort(-scores[start:end], kind="stable")
+            results.append(self._image_results(scores[start:end][order], rows[start:end][order], threshold))
+        return results
+
+    def search_image_range(self, query_text, threshold=None):
+        """Every image scoring at least threshold against query_text, best first."""
+        threshold = self.image_similarity_threshold if threshold is None else threshold
+        query_image_embeddings = DocumentUtils.embed_text_with_clip(text=query_text, clip_model=self.clip_model, clip_tokenizer=self.clip_tokenizer)
+        return self._range_results(query_image_embeddings, threshold)[0]
+
+    def search_images(self, query_text):
+        """search_image or search_image_range, depending on IMAGE_SEARCH_MODE."""
+        if IMAGE_SEARCH_MODE == "range":
+            return self.search_image_range(query_text)
+        return self.search_image(query_text)
 
     def search_text(self, query_text, k):
         top_k_docs = self.text_vectorstore.similarity_search(query_text, k=k)
@@ -148,23 +361,54 @@ class MultiModalRAG:
     async def asearch_text(self, query_text, k):
         top_k_docs = self.text_vectorstore.asimilarity_search(query_text, k=k)
         return top_k_docs
+
+    def retrieve(self, queries, top_k_docs, k_images=IMAGE_SEARCH_TOP_K):
+        """search_text and search_images for many queries at once: one embeddings call, one CLIP forward pass and
+        one search per index. Returns {query: (documents, image_paths)}."""
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return {}
+        if hasattr(self.embeddings, "embed_queries"):
+            query_vectors = self.embeddings.embed_queries(queries)
+        else:
+            query_vectors = [self.embeddings.embed_query(query) for query in queries]
+        query_vectors = np.array(query_vectors, dtype="float32")
+        if getattr(self.text_vectorstore, "_normalize_L2", False):
+            faiss.normalize_L2(query_vectors)
+        _, text_rows = self.text_vectorstore.index.search(query_vectors, top_k_docs)
+        documents = [
+            [self.text_vectorstore.docstore.search(self.text_vectorstore.index_to_docstore_id[row]) for row in rows if row != -1]
+            for rows in text_rows
+        ]
+
+        images = [[] for _ in queries]
+        if self.include_images and self.image_count() >= 5:
+            query_image_embeddings = DocumentUtils.embed_texts_with_clip(queries, clip_model=self.clip_model, clip_tokenizer=self.clip_tokenizer)
+            if IMAGE_SEARCH_MODE == "range":
+                images = self._range_results(query_image_embeddings, self.image_similarity_threshold)
+            else:
+                tombstones = len(self.indexed_image_paths()) - self.image_count()
+                scores, image_rows = self.image_vectorstore.search(query_image_embeddings, k=min(k_images + tombstones, self.image_vectorstore.ntotal))
+                images = [self._image_results(query_scores, rows, self.image_similarity_threshold)[:k_images] for query_scores, rows in zip(scores, image_rows)]
+        return {query: (query_documents, query_images) for query, query_documents, query_images in zip(queries, documents, images)}
+
+    async def _search(self, query_text, top_k_docs, retrieved=None, include_images=True):
+        if retrieved is not None and query_text in retrieved:
+            return retrieved[query_text]
+        if include_images:
+            return await asyncio.gather(
+                asyncio.to_thread(self.search_text, query_text, top_k_docs),
+                asyncio.to_thread(self.search_images, query_text),
+            )
+        return await asyncio.to_thread(self.search_text, query_text, top_k_docs), []
     
-    async def run(self, content_generator : ContentGenerator, module_name : str, submodule_split : dict, profile : str, top_k_docs : int):
-        images_in_directory = []
-        if self.include_images:
-            for root, dirs, files in os.walk(self.image_directory_path):
-                for file in files:
-                    if file.endswith(('png', 'jpg', 'jpeg')):
-                        images_in_directory.append(os.path.join(root, file))
+    async def run(self, content_generator : ContentGenerator, module_name : str, submodule_split : dict, profile : str, top_k_docs : int, retrieved=None):
+        image_count = self.image_count() if self.include_images else 0
         submodule_content = []
         submodule_images=[]
         for key, val in submodule_split.items():
-            if len(images_in_directory) >= 5:
-                with ThreadPoolExecutor() as executor:
-                    future_docs = executor.submit(self.search_text, val, top_k_docs)
-                    future_images = executor.submit(self.search_image, val, images_in_directory)
-                relevant_docs = future_docs.result()
-                top_images = future_images.result()
+            if image_count >= 5:
+                relevant_docs, top_images = await self._search(val, top_k_docs, retrieved)
                 relevant_images = [DocumentUtils.image_to_base64(image_path) for image_path in top_images]
                 if len(top_images) >= 2:
                     rel_docs = [doc.page_content for doc in relevant_docs]
@@ -185,7 +429,7 @@ class MultiModalRAG:
                     finally:
                         result_handler.stop()
             else:
-                relevant_docs = self.search_text(val, top_k_docs)
+                relevant_docs, _ = await self._search(val, top_k_docs, retrieved, include_images=False)
                 rel_docs = [doc.page_content for doc in relevant_docs]
                 context = '\n'.join(rel_docs)
                 result_handler = ResultHandler.start()
@@ -202,25 +446,17 @@ class MultiModalRAG:
             submodule_images.append(relevant_images)
         return submodule_content, submodule_images
     
-    async def run_with_web(self, content_generator : ContentGenerator, tavily_client: TavilyProvider, module_name : str, submodule_split : dict, profile : str, top_k_docs : int):
-        images_in_directory = []
-        if self.include_images:
-            for root, dirs, files in os.walk(self.image_directory_path):
-                for file in files:
-                    if file.endswith(('png', 'jpg', 'jpeg')):
-                        images_in_directory.append(os.path.join(root, file))
+    async def run_with_web(self, content_generator : ContentGenerator, tavily_client: TavilyProvider, module_name : str, submodule_split : dict, profile : str, top_k_docs : int, retrieved=None):
+        image_count = self.image_count() if self.include_images else 0
         submodule_content = []
         submodule_images=[]
         for key, val in submodule_split.items():
             tavily_query = self.course_name + " : " + val
-            if len(images_in_directory) >= 5:
-                with ThreadPoolExecutor() as executor:
-                    future_docs = executor.submit(self.search_text, val, top_k_docs)
-                    future_images = executor.submit(self.search_image, val, images_in_directory)
-                    future_web_context = executor.submit(tavily_client.search_context, tavily_query)
-                relevant_docs = future_docs.result()
-                top_images = future_images.result()
-                web_context = future_web_context.result()
+            if image_count >= 5:
+                (relevant_docs, top_images), web_context = await asyncio.gather(
+                    self._search(val, top_k_docs, retrieved),
+                    tavily_client.asearch_context(tavily_query),
+                )
                 relevant_images = [DocumentUtils.image_to_base64(image_path) for image_path in top_images]
                 if len(top_images) >= 2:
                     rel_docs = [doc.page_content for doc in relevant_docs]
@@ -241,11 +477,10 @@ class MultiModalRAG:
                     finally:
                         result_handler.stop()
             else:
-                with ThreadPoolExecutor() as executor:
-                    future_docs = executor.submit(self.search_text, val, top_k_docs)
-                    future_web_context = executor.submit(tavily_client.search_context, tavily_query)
-                relevant_docs = future_docs.result()
-                web_context = future_web_context.result()
+                (relevant_docs, _), web_context = await asyncio.gather(
+                    self._search(val, top_k_docs, retrieved, include_images=False),
+                    tavily_client.asearch_context(tavily_query),
+                )
                 rel_docs = [doc.page_content for doc in relevant_docs]
                 context = '\n'.join(rel_docs)
                 result_handler = ResultHandler.start()
@@ -262,30 +497,15 @@ class MultiModalRAG:
             submodule_images.append(relevant_images)
         return submodule_content, submodule_images
     
-    async def execute(self, content_generator, tavily_client, module_name, submodules: dict, profile, top_k_docs=5, search_web=False):
-        keys_list = list(submodules.keys())
-        submodules_split_one = {key: submodules[key] for key in keys_list[:2]}
-        submodules_split_two = {key: submodules[key] for key in keys_list[2:4]}
-        submodules_split_three = {key: submodules[key] for key in keys_list[4:]}
+    async def execute(self, content_generator, tavily_client, module_name, submodules: dict, profile, top_k_docs=5, search_web=False, scheduler=None):
+        scheduler = scheduler or SubmoduleScheduler()
         result_handler = ResultHandler.start()
 
         try:
-            if search_web:
-                with ThreadPoolExecutor() as executor:
-                    tasks = [
-                        executor.submit(asyncio.run, self.run_with_web(content_generator=content_generator, tavily_client=tavily_client, module_name=module_name, submodule_split=submodules_split_one, profile=profile, top_k_docs=top_k_docs)),
-                        executor.submit(asyncio.run, self.run_with_web(content_generator=content_generator, tavily_client=tavily_client, module_name=module_name, submodule_split=submodules_split_two, profile=profile, top_k_docs=top_k_docs)),
-                        executor.submit(asyncio.run, self.run_with_web(content_generator=content_generator, tavily_client=tavily_client, module_name=module_name, submodule_split=submodules_split_three, profile=profile, top_k_docs=top_k_docs)),
-                    ]
-                    results = [task.result() for task in tasks]
-            else:
-                with ThreadPoolExecutor() as executor:
-                    tasks = [
-                        executor.submit(asyncio.run, self.run(content_generator, module_name, submodules_split_one, profile, top_k_docs)),
-                        executor.submit(asyncio.run, self.run(content_generator, module_name, submodules_split_two, profile, top_k_docs)),
-                        executor.submit(asyncio.run, self.run(content_generator, module_name, submodules_split_three, profile, top_k_docs)),
-                    ]
-                    results = [task.result() for task in tasks]
+            # Retrieval for every submodule in one batch, then one generation task per submodule on the caller's
+            # event loop; Gemini calls are also bounded by GeminiProvider's semaphore.
+            retrieved = await asyncio.to_thread(self.retrieve, list(submodules.values()), top_k_docs)
+            results = await scheduler.arun(self._submodule_task(content_generator, tavily_client, module_name, profile, top_k_docs, search_web, retrieved), submodules)
 
             content = []
             images = []
@@ -297,4 +517,21 @@ class MultiModalRAG:
         finally:
             result_handler.stop()
 
-        return content, images
\ No newline at end of file
+        return content, images
+
+    async def stream(self, content_generator, tavily_client, module_name, submodules: dict, profile, top_k_docs=5, search_web=False, scheduler=None):
+        scheduler = scheduler or SubmoduleScheduler()
+        retrieved = await asyncio.to_thread(self.retrieve, list(submodules.values()), top_k_docs)
+        results = scheduler.astream(self._submodule_task(content_generator, tavily_client, module_name, profile, top_k_docs, search_web, retrieved), submodules)
+        try:
+            async for index, (content_part, images_part) in results:
+                yield index, (content_part[0], images_part[0])
+        finally:
+            await results.aclose()
+
+    def _submodule_task(self, content_generator, tavily_client, module_name, profile, top_k_docs, search_web, retrieved=None):
+        async def task(split):
+            if search_web:
+                return await self.run_with_web(content_generator=content_generator, tavily_client=tavily_client, module_name=module_name, submodule_split=split, profile=profile, top_k_docs=top_k_docs, retrieved=retrieved)
+            return await self.run(content_generator, module_name, split, profile, top_k_docs, retrieved=retrieved)
+        return task
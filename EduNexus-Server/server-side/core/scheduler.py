@@ -0,0 +1,58 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+SUBMODULE_CONCURRENCY = int(os.getenv("SUBMODULE_CONCURRENCY", "6"))
+
+
+class SubmoduleScheduler:
+    """Fans a module out into one task per submodule, at most max_concurrency at a time, so wall time stays
+    close to a single generation call however many submodules there are. Each task is called as
+    task({key: val}); API keys are picked per request by the providers' key pools."""
+    def __init__(self, max_concurrency=SUBMODULE_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+
+    @staticmethod
+    def _splits(submodules: dict):
+        return [{key: val} for key, val in submodules.items()]
+
+    @staticmethod
+    def flatten(results):
+        # The ContentGenerator.generate_content* methods return one list per split.
+        return [item for result in results for item in result]
+
+    def run(self, task, submodules: dict):
+        """Returns the task results in submodule order."""
+        splits = self._splits(submodules)
+        if not splits:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(splits))) as executor:
+            futures = [executor.submit(task, split) for split in splits]
+            return [future.result() for future in futures]
+
+    async def arun(self, task, submodules: dict):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def limited(split):
+            async with semaphore:
+                return await task(split)
+
+        return await asyncio.gather(*[limited(split) for split in self._splits(submodules)])
+
+    async def astream(self, task, submodules: dict):
+        """Yields (index, result) as each submodule finishes. Closing the generator cancels the rest."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def limited(index, split):
+            async with semaphore:
+                return index, await task(split)
+
+        running = [asyncio.create_task(limited(index, split)) for index, split in enumerate(self._splits(submodules))]
+        try:
+            for next_finished in asyncio.as_completed(running):
+                yield await next_finished
+        finally:
+            for pending in running:
+                pending.cancel()
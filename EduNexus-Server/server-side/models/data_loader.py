@@ -1,19 +1,22 @@
-import faiss
-from langchain_community.document_loaders import PyPDFDirectoryLoader,WebBaseLoader
+from langchain_community.document_loaders import PyPDFDirectoryLoader,WebBaseLoader,PyPDFLoader
 from langchain_community.document_loaders.merge import MergedDataLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
 from models.data_utils import DocumentUtils, WebUtils
+from models.index_manifest import IndexManifest
+from models.index_factory import IndexFactory
+from models.embedding_cache import IMAGE_EMBEDDING_STORE
 from server.utils import ServerUtils
-from deep_translator import GoogleTranslator
+from api.translation import TRANSLATION_ENGINE
 import asyncio
 import numpy as np
+import fitz
 import os
 
 SCRAPFLY_API_KEY = os.getenv("SCRAPFLY_API_KEY")
+CLIP_EMBEDDING_DIMENSION = 512
 class DocumentLoader:
     @staticmethod
-    async def create_faiss_vectorstore_for_text(documents_directory, embeddings, chunk_size, chunk_overlap, input_type, links):
+    async def create_faiss_vectorstore_for_text(documents_directory, embeddings, chunk_size, chunk_overlap, input_type, links, index_type=None):
         print("\nCreating FAISS Vector database for text...\n")
         if input_type=="pdf":
             loader = PyPDFDirectoryLoader(documents_directory)
@@ -41,35 +44,77 @@ class DocumentLoader:
         source_language = "english"
         if source_language != 'english':
             print(f"\nDocument is {source_language}. Translating to English\n")
-            trans_texts = GoogleTranslator(source=source_language, target='en').translate_batch(texts)
+            trans_texts = TRANSLATION_ENGINE.translate_batch(texts, 'en', source=source_language)
         else:
             print("Document language is English. No translation required.")
             trans_texts = texts
-        vectorstore = FAISS.from_texts(trans_texts, embeddings)
+        vectorstore = await IndexFactory.build_text_vectorstore(trans_texts, embeddings, index_type=index_type)
         print("\nFAISS Vector database for text created.\n")
         return vectorstore
     
     @staticmethod
-    async def create_faiss_vectorstore_for_image(documents_directory, image_directory_path, clip_model, clip_processor, input_type, links):
-        print("\nCreating FAISS Vector database for images...\n")
-        if input_type=="pdf":
-            await DocumentUtils.extract_images_from_directory(documents_directory=documents_directory, output_directory_path=image_directory_path)
-        elif input_type == "link":
-            await WebUtils.extract_images_from_webpages(urls=links, output_directory_path=image_directory_path)
-        elif input_type =="pdf_and_link":
-            await asyncio.gather(
-                DocumentUtils.extract_images_from_directory(documents_directory,image_directory_path),
-                WebUtils.extract_images_from_webpages(links,image_directory_path)
-            )
+    def list_sources(documents_directory, input_type, links):
+        """Source id -> ("file", path) or ("url", url) for everything an index of this input type is built from."""
+        sources = {}
+        if input_type in ("pdf", "pdf_and_link", "pdf_and_web") and documents_directory and os.path.isdir(documents_directory):
+            for filename in sorted(os.listdir(documents_directory)):
+                file_path = os.path.join(documents_directory, filename)
+                if filename.endswith(".pdf") and os.path.isfile(file_path):
+                    sources[IndexManifest.file_source_id(file_path)] = ("file", file_path)
+        if input_type in ("link", "pdf_and_link"):
+            for url in links or []:
+                sources[IndexManifest.url_source_id(url)] = ("url", url)
+        return sources
+
+    @staticmethod
+    async def load_source_texts(source, chunk_size, chunk_overlap):
+        source_type, location = source
+        if source_type == "file":
+            loader = PyPDFLoader(location)
+        else:
+            loader = WebBaseLoader([location], continue_on_failure=True)
+        documents = await asyncio.to_thread(loader.load)
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len
+        )
+        docs = text_splitter.split_documents(documents)
+        return [doc.page_content.replace('\n', '') for doc in docs]
+
+    @staticmethod
+    async def extract_source_images(source, output_directory_path):
+        source_type, location = source
+        if source_type == "file":
+            os.makedirs(output_directory_path, exist_ok=True)
+            await DocumentUtils.extract_images_from_pdf(fitz.open(location), output_directory_path)
+        else:
+            await WebUtils.extract_images_from_webpages([location], output_directory_path)
+        # Sorted so that, of two copies of a figure, the same one is kept on every run.
+        return sorted(DocumentLoader.list_images(output_directory_path))
+
+    @staticmethod
+    def list_images(image_directory_path):
         images_in_directory = []
         for root, dirs, files in os.walk(image_directory_path):
             for file in files:
                 if file.endswith(('png', 'jpg', 'jpeg')):
                     images_in_directory.append(os.path.join(root, file))
-        
-        image_embeddings = np.vstack([DocumentUtils.embed_image_with_clip(image, clip_model=clip_model, clip_processor=clip_processor) for image in images_in_directory])
-        print("\nImages converted to embeddings\n")
-        vectorstore = faiss.IndexFlatIP(512)
-        vectorstore.add(image_embeddings)
-        print("\nFAISS Vector database for images created.\n")
-        return vectorstore
+        return images_in_directory
+
+    @staticmethod
+    def embed_images(image_paths, clip_model, clip_processor):
+        if not image_paths:
+            return np.zeros((0, CLIP_EMBEDDING_DIMENSION), dtype="float32")
+        model_name = getattr(clip_model, "name_or_path", None) or type(clip_model).__name__
+        keys = [IMAGE_EMBEDDING_STORE.key(image_path, model_name) for image_path in image_paths]
+        vectors = IMAGE_EMBEDDING_STORE.get_many(set(keys))
+        # One image per unseen key: figures repeated across pages or textbooks are embedded once.
+        missing = {}
+        for image_path, key in zip(image_paths, keys):
+            if key not in vectors:
+                missing.setdefault(key, image_path)
+        if missing:
+            new_vectors = DocumentUtils.embed_images_with_clip(list(missing.values()), clip_model=clip_model, clip_processor=clip_processor)
+            IMAGE_EMBEDDING_STORE.set_many(zip(missing.keys(), new_vectors))
+            vectors.update(zip(missing.keys(), new_vectors))
+        print(f"Embedded {len(image_paths)} images, {len(missing)} not in the cache")
+        return np.vstack([vectors[key] for key in keys])
@@ -9,8 +9,24 @@ import httpx
 from bs4 import BeautifulSoup
 from pathlib import Path
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import numpy as np
 import re
 
+load_dotenv()
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "32"))
+CLIP_DECODE_WORKERS = int(os.getenv("CLIP_DECODE_WORKERS", "4"))
+CLIP_TORCH_THREADS = os.getenv("CLIP_TORCH_THREADS")
+if CLIP_TORCH_THREADS:
+    torch.set_num_threads(int(CLIP_TORCH_THREADS))
+# Logos, icons, rules and tracking pixels fall below these and are dropped before they are embedded.
+IMAGE_MIN_WIDTH = int(os.getenv("IMAGE_MIN_WIDTH", "100"))
+IMAGE_MIN_HEIGHT = int(os.getenv("IMAGE_MIN_HEIGHT", "100"))
+IMAGE_MIN_BYTES = int(os.getenv("IMAGE_MIN_BYTES", "1024"))
+# Images whose 64-bit difference hashes differ in at most this many bits are treated as the same figure.
+IMAGE_DUPLICATE_DISTANCE = int(os.getenv("IMAGE_DUPLICATE_DISTANCE", "8"))
+
 class DocumentUtils:
 
     @staticmethod
@@ -25,6 +41,8 @@ class DocumentUtils:
                     base_image = pdf_document.extract_image(xref)
                     image_ext = base_image["ext"]
                     image_bytes = base_image["image"]
+                    if ImageFilter.is_too_small(base_image["width"], base_image["height"], len(image_bytes)):
+                        continue
                     image_path = f"{pdf_output_directory}/image_{page_index + 1}_{image_index}.{image_ext}"
                     image = Image.open(io.BytesIO(image_bytes))
                     image.save(image_path)
@@ -54,14 +72,32 @@ class DocumentUtils:
         print(f"Images extracted from all documents in {documents_directory} and saved to {output_directory_path}")
 
     @staticmethod
-    def embed_image_with_clip(image_path, clip_model, clip_processor, device_type="cpu"):
-        image = Image.open(image_path)
-        inputs = clip_processor(images=image, return_tensors="pt").to(device_type)
-        with torch.no_grad():
-            image_features = clip_model.get_image_features(**inputs)
-        image_features_normalized = image_features / image_features.norm(dim=-1, keepdim=True)
-        image_features_normalized = image_features_normalized.cpu().numpy()
-        return image_features_normalized
+    def _load_rgb_image(image_path):
+        with Image.open(image_path) as image:
+            return image.convert("RGB")
+
+    @staticmethod
+    def embed_images_with_clip(image_paths, clip_model, clip_processor, batch_size=CLIP_BATCH_SIZE, device_type=None):
+        """Normalized CLIP embeddings of image_paths, one row per image, computed batch_size images at a time.
+        The next batch is decoded on a thread pool while the model runs on the current one."""
+        image_paths = list(image_paths)
+        if not image_paths:
+            return np.zeros((0, clip_model.config.projection_dim), dtype="float32")
+        device_type = device_type or clip_model.device
+        batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+        embeddings = []
+        with ThreadPoolExecutor(max_workers=CLIP_DECODE_WORKERS) as executor:
+            decoding = [executor.submit(DocumentUtils._load_rgb_image, path) for path in batches[0]]
+            for batch_index in range(len(batches)):
+                images = [future.result() for future in decoding]
+                if batch_index + 1 < len(batches):
+                    decoding = [executor.submit(DocumentUtils._load_rgb_image, path) for path in batches[batch_index + 1]]
+                inputs = clip_processor(images=images, return_tensors="pt").to(device_type)
+                with torch.inference_mode():
+                    image_features = clip_model.get_image_features(**inputs)
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                embeddings.append(image_features.cpu().numpy().astype("float32"))
+        return np.vstack(embeddings)
 
     @staticmethod
     def embed_text_with_clip(text, clip_model, clip_tokenizer, device_type="cpu"):
@@ -72,6 +108,16 @@ class DocumentUtils:
         text_features_normalized = text_features_normalized.cpu().numpy()
         return text_features_normalized
     
+    @staticmethod
+    def embed_texts_with_clip(texts, clip_model, clip_tokenizer, device_type=None):
+        """embed_text_with_clip for many texts in one forward pass; one row per text."""
+        device_type = device_type or clip_model.device
+        inputs = clip_tokenizer(list(texts), padding=True, truncation=True, return_tensors="pt").to(device_type)
+        with torch.inference_mode():
+            text_features = clip_model.get_text_features(**inputs)
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        return text_features.cpu().numpy().astype("float32")
+
     @staticmethod
     def image_to_base64(image_path):
         with open(image_path, "rb") as image_file:
@@ -141,4 +187,63 @@ class WebUtils:
                 url_download_dir.mkdir(parents=True, exist_ok=True)
                 scrape_tasks.append(WebUtils.scrape_images(valid_url, client, url_download_dir))
             await asyncio.gather(*scrape_tasks)
-        print("\nExtracted images from web pages successfully!\n")
\ No newline at end of file
+        print("\nExtracted images from web pages successfully!\n")
+
+
+class ImageFilter:
+    """Drops extracted images that are too small to be figures and near-duplicates of images already kept,
+    using a difference hash (dHash): the image is reduced to 9x8 grayscale and each bit records whether a
+    pixel is brighter than its right-hand neighbour, so re-encoded or resized copies hash alike."""
+    @staticmethod
+    def is_too_small(width, height, size_in_bytes):
+        return width < IMAGE_MIN_WIDTH or height < IMAGE_MIN_HEIGHT or size_in_bytes < IMAGE_MIN_BYTES
+
+    @staticmethod
+    def dhash(image_path):
+        with Image.open(image_path) as image:
+            image.draft("L", (18, 16))
+            pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+        value = 0
+        for row in range(8):
+            for column in range(8):
+                value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+        return value
+
+    @staticmethod
+    def is_duplicate(image_hash, seen_hashes):
+        return any(bin(image_hash ^ seen).count("1") <= IMAGE_DUPLICATE_DISTANCE for seen in seen_hashes)
+
+    @staticmethod
+    def hashes(image_paths):
+        image_hashes = []
+        for image_path in image_paths:
+            try:
+                image_hashes.append(ImageFilter.dhash(image_path))
+            except (OSError, ValueError):
+                continue
+        return image_hashes
+
+    @staticmethod
+    def filter_images(image_paths, seen_hashes=None):
+        """Returns the images worth embedding. Rejected files are deleted so they are never served either.
+        seen_hashes carries hashes across calls, to drop figures repeated in other documents of the lesson."""
+        seen_hashes = seen_hashes if seen_hashes is not None else []
+        kept = []
+        for image_path in image_paths:
+            try:
+                with Image.open(image_path) as image:
+                    width, height = image.size
+                reject = ImageFilter.is_too_small(width, height, os.path.getsize(image_path))
+                if not reject:
+                    image_hash = ImageFilter.dhash(image_path)
+                    reject = ImageFilter.is_duplicate(image_hash, seen_hashes)
+            except (OSError, ValueError):
+                # Unreadable or truncated download.
+                reject = True
+            if reject:
+                os.remove(image_path)
+                continue
+            seen_hashes.append(image_hash)
+            kept.append(image_path)
+        print(f"Kept {len(kept)} of {len(image_paths)} extracted images")
+        return kept
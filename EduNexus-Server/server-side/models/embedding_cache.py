@@ -0,0 +1,160 @@
+import os
+import asyncio
+import inspect
+import hashlib
+import numpy as np
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from api.response_cache import CACHE_DIRECTORY
+from api.storage import connect, hash_file, init_database, select_in, write_transaction
+
+load_dotenv()
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIRECTORY, "embeddings.sqlite3"))
+IMAGE_EMBEDDING_CACHE_DIRECTORY = os.getenv("IMAGE_EMBEDDING_CACHE_DIRECTORY", os.path.join(CACHE_DIRECTORY, "image-embeddings"))
+IMAGE_EMBEDDING_DIMENSION = 512
+
+
+class EmbeddingStore:
+    """Embedding vectors in SQLite as float32 blobs, keyed by hash. Shared by every worker process on the host."""
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = path
+        init_database(path, "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def get_many(self, keys):
+        found = {}
+        with connect(self.path) as conn:
+            for key, blob in select_in(conn, "SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys):
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+        return found
+
+    def set_many(self, items):
+        with connect(self.path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                ((key, array("f", vector).tobytes()) for key, vector in items),
+            )
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings model so that only text it has not seen before is sent to the API. New text is
+    embedded in batches of batch_size, with up to max_concurrency batches in flight."""
+    def __init__(self, embeddings, store=None, batch_size=EMBEDDING_BATCH_SIZE, max_concurrency=EMBEDDING_CONCURRENCY, model_name=None):
+        self.embeddings = embeddings
+        self.store = store if store is not None else EmbeddingStore()
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.model_name = model_name or getattr(embeddings, "model", None) or type(embeddings).__name__
+
+    def _key(self, kind, text):
+        # Document and query embeddings use different task types, so they are cached separately.
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        keys = [self._key("document", text) for text in texts]
+        vectors = self.store.get_many(set(keys))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in vectors))
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(self.embeddings.embed_documents, batches))
+            new_vectors = {}
+            for batch, batch_vectors in zip(batches, results):
+                for text, vector in zip(batch, batch_vectors):
+                    # Round to float32 now so a chunk gets the same vector whether or not it came from the cache.
+                    new_vectors[self._key("document", text)] = array("f", vector).tolist()
+            self.store.set_many(new_vectors.items())
+            vectors.update(new_vectors)
+        print(f"Embedded {len(texts)} chunks, {len(missing)} unique chunks not in the cache")
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key("query", text)
+        vector = self.store.get_many([key]).get(key)
+        if vector is None:
+            vector = array("f", self.embeddings.embed_query(text)).tolist()
+            self.store.set_many([(key, vector)])
+        return vector
+
+    def _embed_query_batch(self, texts):
+        # Google embeddings take the query task type on their batch call; other models get one call per query.
+        if "task_type" in inspect.signature(self.embeddings.embed_documents).parameters:
+            return self.embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def embed_queries(self, texts):
+        """embed_query for many queries at once: one cache lookup and batched calls for the ones not cached."""
+        keys = [self._key("query", text) for text in texts]
+        vectors = self.store.get_many(set(keys))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in vectors))
+        if missing:
+            new_vectors = {}
+            for i in range(0, len(missing), self.batch_size):
+                batch = missing[i:i + self.batch_size]
+                for text, vector in zip(batch, self._embed_query_batch(batch)):
+                    new_vectors[self._key("query", text)] = array("f", vector).tolist()
+            self.store.set_many(new_vectors.items())
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    async def aembed_documents(self, texts):
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+class ImageEmbeddingStore:
+    """Normalized CLIP image vectors keyed by a hash of the image bytes. Vectors are appended to a flat float32
+    file that readers memory-map; a SQLite table maps each key to its row. A writer holds the SQLite write lock
+    while it appends, so processes never interleave rows. Bytes appended by a writer that died before committing
+    are never referenced, and the next writer cuts them off."""
+    def __init__(self, directory=IMAGE_EMBEDDING_CACHE_DIRECTORY, dimension=IMAGE_EMBEDDING_DIMENSION):
+        self.dimension = dimension
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, f"vectors-{dimension}.f32")
+        self.index_path = os.path.join(directory, f"index-{dimension}.sqlite3")
+        open(self.vectors_path, "ab").close()
+        init_database(self.index_path, "CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+
+    @staticmethod
+    def key(image_path, model_name):
+        return hash_file(image_path, hashlib.sha256(f"{model_name}\0".encode("utf-8"))).hexdigest()
+
+    def get_many(self, keys):
+        with connect(self.index_path) as conn:
+            rows = dict(select_in(conn, "SELECT key, row FROM rows WHERE key IN ({placeholders})", keys))
+        if not rows:
+            return {}
+        # Every committed row is already in the file. A torn append can leave a partial row at the end until the
+        # next set_many truncates it, so only whole rows are mapped.
+        row_count = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+        vectors = np.memmap(self.vectors_path, dtype="float32", mode="r", shape=(row_count, self.dimension))
+        return {key: np.array(vectors[row]) for key, row in rows.items()}
+
+    def set_many(self, items):
+        items = [(key, np.asarray(vector, dtype="float32").reshape(self.dimension)) for key, vector in items]
+        if not items:
+            return
+        with write_transaction(self.index_path) as conn:
+            # The committed index, not the file length, says where the next row goes: a write torn by a crash
+            # leaves bytes past the last committed row, which are cut off before appending.
+            first_row = conn.execute("SELECT COALESCE(MAX(row), -1) + 1 FROM rows").fetchone()[0]
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(first_row * 4 * self.dimension)
+                f.seek(first_row * 4 * self.dimension)
+                f.write(np.stack([vector for _, vector in items]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            conn.executemany(
+                "INSERT OR REPLACE INTO rows (key, row) VALUES (?, ?)",
+                ((key, first_row + offset) for offset, (key, _) in enumerate(items)),
+            )
+
+
+IMAGE_EMBEDDING_STORE = ImageEmbeddingStore()
@@ -0,0 +1,140 @@
+import os
+import math
+import uuid
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+load_dotenv()
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "flat").lower()
+# Below this many vectors brute force is both exact and fast enough, and IVF-PQ has too little data to train on.
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "20000"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# Training time grows with the number of subquantizers; 32 keeps it to seconds for typical embedding sizes.
+IVF_PQ_M = int(os.getenv("IVF_PQ_M", "32"))
+IVF_TRAIN_SAMPLE = int(os.getenv("IVF_TRAIN_SAMPLE", "100000"))
+ANN_RECALL_K = int(os.getenv("ANN_RECALL_K", "10"))
+ANN_RECALL_QUERIES = int(os.getenv("ANN_RECALL_QUERIES", "200"))
+ANN_TARGET_RECALL = float(os.getenv("ANN_TARGET_RECALL", "0.95"))
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+
+class IndexFactory:
+    """Builds the FAISS index for a set of vectors: exact (flat) search, HNSW, or IVF-PQ. Anything smaller than
+    ANN_MIN_VECTORS gets a flat index whatever type was asked for. Approximate indexes are checked against flat
+    search after they are built and their search breadth (efSearch / nprobe) is raised until recall@k reaches
+    ANN_TARGET_RECALL."""
+    @staticmethod
+    def resolve_type(index_type=None):
+        index_type = (index_type or ANN_INDEX_TYPE).lower()
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"index_type should be one of {', '.join(INDEX_TYPES)}")
+        return index_type
+
+    @staticmethod
+    def is_flat(index):
+        return isinstance(faiss.downcast_index(index), faiss.IndexFlat)
+
+    @staticmethod
+    def _flat(dimension, metric):
+        return faiss.IndexFlatIP(dimension) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dimension)
+
+    @staticmethod
+    def _pq_subquantizers(dimension):
+        # Product quantization needs a number of subquantizers that divides the dimension.
+        return max(m for m in range(1, min(IVF_PQ_M, dimension) + 1) if dimension % m == 0)
+
+    @staticmethod
+    def build(vectors, index_type=None, metric=faiss.METRIC_L2):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        count, dimension = vectors.shape
+        index_type = IndexFactory.resolve_type(index_type)
+        if index_type == "flat" or count < ANN_MIN_VECTORS:
+            index = IndexFactory._flat(dimension, metric)
+            index.add(vectors)
+            return index
+        if index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, HNSW_M, metric)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+            index = faiss.IndexIVFPQ(IndexFactory._flat(dimension, metric), dimension, nlist, IndexFactory._pq_subquantizers(dimension), 8, metric)
+            sample = vectors
+            if count > IVF_TRAIN_SAMPLE:
+                sample = vectors[np.random.default_rng(0).choice(count, IVF_TRAIN_SAMPLE, replace=False)]
+            index.train(sample)
+            index.nprobe = min(IVF_NPROBE, nlist)
+        index.add(vectors)
+        IndexFactory.tune(index, vectors)
+        print(f"Built {index_type} index over {count} vectors")
+        return index
+
+    @staticmethod
+    def upgrade(index, index_type=None):
+        """Rebuilds a flat index that has grown past ANN_MIN_VECTORS as the configured approximate type.
+        Row order is kept, so docstore mappings and image paths stay valid."""
+        if IndexFactory.resolve_type(index_type) == "flat" or index.ntotal < ANN_MIN_VECTORS or not IndexFactory.is_flat(index):
+            return index
+        return IndexFactory.build(index.reconstruct_n(0, index.ntotal), index_type, index.metric_type)
+
+    @staticmethod
+    def _exact_neighbours(vectors, metric, k, queries):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        sample = vectors[np.random.default_rng(1).choice(len(vectors), min(queries, len(vectors)), replace=False)]
+        exact = IndexFactory._flat(vectors.shape[1], metric)
+        exact.add(vectors)
+        _, expected = exact.search(sample, min(k, len(vectors)))
+        return sample, expected
+
+    @staticmethod
+    def _recall(index, sample, expected):
+        _, found = index.search(sample, expected.shape[1])
+        hits = sum(len(set(expected_row) & set(found_row)) for expected_row, found_row in zip(expected, found))
+        return hits / expected.size
+
+    @staticmethod
+    def recall_at_k(index, vectors, k=ANN_RECALL_K, queries=ANN_RECALL_QUERIES, neighbours=None):
+        """Fraction of the exact top-k neighbours of a sample of the indexed vectors that the index also returns.
+        neighbours is a (sample, expected) pair from an earlier _exact_neighbours call, to check one index
+        repeatedly without redoing the exact search."""
+        if neighbours is None:
+            neighbours = IndexFactory._exact_neighbours(vectors, index.metric_type, k, queries)
+        return IndexFactory._recall(index, *neighbours)
+
+    @staticmethod
+    def tune(index, vectors):
+        index = faiss.downcast_index(index)
+        neighbours = IndexFactory._exact_neighbours(vectors, index.metric_type, ANN_RECALL_K, ANN_RECALL_QUERIES)
+        recall = IndexFactory.recall_at_k(index, vectors, neighbours=neighbours)
+        if isinstance(index, faiss.IndexHNSW):
+            while recall < ANN_TARGET_RECALL and index.hnsw.efSearch < 1024:
+                index.hnsw.efSearch *= 2
+                recall = IndexFactory.recall_at_k(index, vectors, neighbours=neighbours)
+            print(f"HNSW efSearch={index.hnsw.efSearch}, recall@{ANN_RECALL_K}={recall:.3f}")
+        elif isinstance(index, faiss.IndexIVF):
+            previous = -1.0
+            # PQ codes are lossy, so recall levels off below the target at some nprobe; probing more past that
+            # point only costs latency.
+            while recall < ANN_TARGET_RECALL and index.nprobe < index.nlist and recall - previous > 0.005:
+                index.nprobe = min(index.nprobe * 2, index.nlist)
+                previous, recall = recall, IndexFactory.recall_at_k(index, vectors, neighbours=neighbours)
+            print(f"IVF-PQ nprobe={index.nprobe}, recall@{ANN_RECALL_K}={recall:.3f}")
+        if recall < ANN_TARGET_RECALL:
+            print(f"Warning: recall@{ANN_RECALL_K} {recall:.3f} is below the target of {ANN_TARGET_RECALL}")
+        return recall
+
+    @staticmethod
+    async def build_text_vectorstore(texts, embeddings, ids=None, index_type=None):
+        """FAISS.afrom_texts with the index chosen by build()."""
+        vectors = await embeddings.aembed_documents(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        index = IndexFactory.build(np.array(vectors, dtype="float32"), index_type)
+        docstore = InMemoryDocstore({doc_id: Document(page_content=text) for doc_id, text in zip(ids, texts)})
+        return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
@@ -0,0 +1,66 @@
+import os
+import json
+import tempfile
+from api.storage import hash_file
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+class IndexManifest:
+    """Records which sources an index was built from (uploaded files by content hash, links by URL), the ids of
+    their chunks in the text docstore and their rows in the image index. `image_paths` is aligned with the image
+    index rows; rows of removed sources are tombstoned (set to None) so the remaining row numbers stay valid."""
+    def __init__(self, settings=None, sources=None, image_paths=None):
+        self.settings = settings or {}
+        self.sources = sources or {}
+        self.image_paths = image_paths or []
+
+    @staticmethod
+    def file_source_id(path):
+        return f"file:{hash_file(path).hexdigest()}"
+
+    @staticmethod
+    def url_source_id(url):
+        return f"url:{url}"
+
+    @classmethod
+    def load(cls, index_directory):
+        path = os.path.join(index_directory, MANIFEST_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(settings=data.get("settings"), sources=data.get("sources"), image_paths=data.get("image_paths"))
+
+    def save(self, index_directory):
+        path = os.path.join(index_directory, MANIFEST_FILENAME)
+        # A unique temporary name, so concurrent saves never write to the same file.
+        fd, temp_path = tempfile.mkstemp(dir=index_directory, prefix=f"{MANIFEST_FILENAME}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"settings": self.settings, "sources": self.sources, "image_paths": self.image_paths}, f)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def diff(self, source_ids):
+        added = [source_id for source_id in source_ids if source_id not in self.sources]
+        removed = [source_id for source_id in self.sources if source_id not in source_ids]
+        return added, removed
+
+    def remove_source(self, source_id):
+        """Forget a source and return its text chunk ids; its image rows become tombstones."""
+        entry = self.sources.pop(source_id)
+        for row in entry.get("image_rows", []):
+            self.image_paths[row] = None
+        return entry.get("text_ids", [])
+
+    def live_image_count(self):
+        return sum(path is not None for path in self.image_paths)
+
+    def tombstone_ratio(self):
+        if not self.image_paths:
+            return 0.0
+        return 1 - self.live_image_count() / len(self.image_paths)
@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import faiss
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from api.single_flight import SingleFlight
+from api.storage import hash_file
+
+load_dotenv()
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+INDEX_CACHE_MAX_ENTRIES = int(os.getenv("INDEX_CACHE_MAX_ENTRIES", "32"))
+# Shared indexes are memory-mapped, so every worker process on the host reads the same pages of the OS cache.
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"
+TEXT_INDEX_FILENAME = "index.faiss"
+DOCSTORE_FILENAME = "docstore.json"
+# A text index directory holds one subdirectory per saved version (index + docstore) and a file naming the
+# current one, so a reader always gets an index and a docstore that were saved together.
+CURRENT_VERSION_FILENAME = "CURRENT"
+# Superseded versions are deleted once they are this old; until then a save still being written by another
+# thread, or a reader that looked up CURRENT just before it changed, can use them.
+STALE_VERSION_SECONDS = 300
+
+
+def _index_size(index):
+    # Vectors dominate the footprint of the flat indexes built here; the docstore is small next to them.
+    raw_index = getattr(index, "index", index)
+    return getattr(raw_index, "ntotal", 0) * getattr(raw_index, "d", 0) * 4
+
+
+def _path_mtime(path):
+    if os.path.isdir(path):
+        return max((os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)), default=os.path.getmtime(path))
+    return os.path.getmtime(path)
+
+
+def _replace_file(path, write):
+    # Never rewrite a file in place: other processes may have it memory-mapped, and truncating a mapped file
+    # crashes them. Write a new file and swap it in; existing mappings keep the old inode. The temporary name
+    # is unique, so concurrent saves of the same index never write to the same file.
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _current_version(path):
+    current_path = os.path.join(path, CURRENT_VERSION_FILENAME)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path, "r", encoding="utf-8") as f:
+        return os.path.join(path, f.read().strip())
+
+
+def _read_index(path, mmap):
+    if not mmap:
+        return faiss.read_index(path)
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    # IVF indexes ("Iw..") map their inverted lists; flat and HNSW indexes map their vector storage, which
+    # needs a FAISS build with IO_FLAG_MMAP_IFC (older builds read it into memory instead).
+    if fourcc.startswith(b"Iw"):
+        flags = faiss.IO_FLAG_MMAP
+    else:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY)
+
+
+class IndexRegistry:
+    """Process-wide LRU of loaded FAISS indexes keyed by their path on disk, bounded by an estimate of the
+    memory they use. An entry is reloaded if the files on disk have changed since it was loaded.
+
+    Indexes handed out by the registry are memory-mapped and read-only; anything that adds to or deletes from
+    an index must work on a private copy from load_text / load_image."""
+    def __init__(self, max_bytes=INDEX_CACHE_MAX_BYTES, max_entries=INDEX_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loads = SingleFlight()
+
+    @staticmethod
+    def namespace(*parts):
+        return os.path.join(*[re.sub(r'[<>:"/\\|?*\s]+', '_', str(part)).strip('._') or '_' for part in parts])
+
+    @staticmethod
+    def content_hash(paths=(), extra=()):
+        """Hash of the files under paths (names and bytes) plus any extra values, e.g. links and chunking settings."""
+        digest = hashlib.sha256()
+        for path in paths:
+            if path is None or not os.path.exists(path):
+                continue
+            files = [path] if os.path.isfile(path) else sorted(
+                os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+            )
+            for file_path in files:
+                digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+                hash_file(file_path, digest)
+        for value in extra:
+            digest.update(repr(value).encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def _get(self, path, loader):
+        key = os.path.abspath(path)
+        mtime = _path_mtime(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == mtime:
+                self._entries.move_to_end(key)
+                return entry[0]
+        # Concurrent requests for an index that is not resident share one load.
+        index = self._loads.do(key, loader)
+        self._put(key, index, mtime)
+        return index
+
+    def _put(self, key, index, mtime):
+        size = _index_size(index)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (index, mtime, size)
+            self._bytes += size
+            while len(self._entries) > 1 and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    @staticmethod
+    def load_text(path, embeddings, mmap=False):
+        version_path = _current_version(path) or path
+        docstore_path = os.path.join(version_path, DOCSTORE_FILENAME)
+        if not os.path.exists(docstore_path):
+            # Indexes saved before the JSON docstore existed.
+            return FAISS.load_local(path, embeddings=embeddings, allow_dangerous_deserialization=True)
+        index = _read_index(os.path.join(version_path, TEXT_INDEX_FILENAME), mmap)
+        with open(docstore_path, "r", encoding="utf-8") as f:
+            documents = json.load(f)
+        docstore = InMemoryDocstore({
+            document["id"]: Document(page_content=document["page_content"], metadata=document.get("metadata", {}))
+            for document in documents
+        })
+        return FAISS(embeddings, index, docstore, {position: document["id"] for position, document in enumerate(documents)})
+
+    @staticmethod
+    def load_image(path, mmap=False):
+        return _read_index(path, mmap)
+
+    def get_text(self, path, embeddings):
+        return self._get(path, lambda: IndexRegistry.load_text(path, embeddings, mmap=INDEX_MMAP))
+
+    def get_image(self, path):
+        return self._get(path, lambda: IndexRegistry.load_image(path, mmap=INDEX_MMAP))
+
+    def save_text(self, path, vectorstore):
+        os.makedirs(path, exist_ok=True)
+        # Documents in index row order, so row i of the index is documents[i].
+        documents = []
+        for position in range(len(vectorstore.index_to_docstore_id)):
+            doc_id = vectorstore.index_to_docstore_id[position]
+            document = vectorstore.docstore.search(doc_id)
+            documents.append({"id": doc_id, "page_content": document.page_content, "metadata": document.metadata})
+
+        # Both files go into a new version directory, which only becomes visible once CURRENT names it.
+        previous_version = _current_version(path)
+        version = f"v-{uuid.uuid4().hex}"
+        version_path = os.path.join(path, version)
+        os.makedirs(version_path)
+        faiss.write_index(vectorstore.index, os.path.join(version_path, TEXT_INDEX_FILENAME))
+        with open(os.path.join(version_path, DOCSTORE_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(documents, f, ensure_ascii=False)
+
+        def write_current(temp_path):
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(version)
+
+        _replace_file(os.path.join(path, CURRENT_VERSION_FILENAME), write_current)
+        now = time.time()
+        for name in os.listdir(path):
+            name_path = os.path.join(path, name)
+            if name.startswith("v-") and name_path not in (version_path, previous_version) and now - os.path.getmtime(name_path) > STALE_VERSION_SECONDS:
+                shutil.rmtree(name_path, ignore_errors=True)
+        self._put(os.path.abspath(path), vectorstore, _path_mtime(path))
+
+    def save_image(self, path, index):
+        _replace_file(path, lambda temp_path: faiss.write_index(index, temp_path))
+        self._put(os.path.abspath(path), index, _path_mtime(path))
+
+    def evict(self, path):
+        with self._lock:
+            entry = self._entries.pop(os.path.abspath(path), None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+
+INDEX_REGISTRY = IndexRegistry()
@@ -4,6 +4,8 @@ from transformers import AutoImageProcessor, AutoModel, AutoTokenizer
 from api.gemini_client import GeminiProvider
 from api.serper_client import SerperProvider
 from api.tavily_client import TavilyProvider
+from api.single_flight import SingleFlight
+from models.embedding_cache import CachedEmbeddings
 from core.submodule_generator import SubModuleGenerator
 from core.content_generator import ContentGenerator
 from core.module_generator import ModuleGenerator
@@ -16,7 +18,9 @@ from core.recommendation_generator import RecommendationGenerator
 from core.lesson_planner import LessonPlanner
 from core.skills_analyzer import SkillsAnalyzer
 from core.teacher_pdf_generator import MarkdownPdfGenerator
+from core.scheduler import SubmoduleScheduler
 from server.utils import AssistantUtils
+from server.jobs.queue import JobQueue
 import os
 
 DEVICE_TYPE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -24,7 +28,7 @@ IMAGE_EMBEDDING_MODEL_NAME = "openai/clip-vit-base-patch16"
 CLIP_MODEL = AutoModel.from_pretrained(IMAGE_EMBEDDING_MODEL_NAME).to(DEVICE_TYPE)
 CLIP_PROCESSOR = AutoImageProcessor.from_pretrained(IMAGE_EMBEDDING_MODEL_NAME)
 CLIP_TOKENIZER = AutoTokenizer.from_pretrained(IMAGE_EMBEDDING_MODEL_NAME, clean_up_tokenization_spaces=True)
-EMBEDDINGS = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+EMBEDDINGS = CachedEmbeddings(GoogleGenerativeAIEmbeddings(model="models/text-embedding-004"))
 GEMINI_CLIENT = GeminiProvider()
 TAVILY_CLIENT = TavilyProvider()
 SERPER_CLIENT = SerperProvider()
@@ -41,7 +45,10 @@ LESSON_PLANNER = LessonPlanner()
 SKILLS_ANALYZER = SkillsAnalyzer()
 RECOMMENDATION_GENERATOR = RecommendationGenerator()
 EVALUATOR = Evaluator()
+SUBMODULE_SCHEDULER = SubmoduleScheduler()
+MODULE_SINGLE_FLIGHT = SingleFlight()
 USER_DOCS_PATH = os.path.join('server', 'user_docs')
+JOB_QUEUE = JobQueue()
 AVAILABLE_TOOLS = {
     'get_context_from_page': AssistantUtils.get_page_context
 }
\ No newline at end of file
@@ -13,6 +13,7 @@ from io import BytesIO
 from bson import ObjectId
 import fitz
 from server.constants import *
+from server.utils import ServerUtils
 from werkzeug.security import check_password_hash, generate_password_hash
 
 load_dotenv()
@@ -178,6 +179,20 @@ def anaylze_conversation():
     video_file_path = os.path.join(uploads_path, filename)
     video_file.save(video_file_path)
     scenario = data.get("scenario")
+    if ServerUtils.run_in_background():
+        job_id = JOB_QUEUE.submit("roleplay_evaluation", evaluate_roleplay_video, student_id, video_file_path, scenario, owner=f"job_seeker:{student_id}")
+        return jsonify({"response": True, "job_id": job_id}), 202
+    try:
+        response = evaluate_roleplay_video(student_id, video_file_path, scenario)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"response": True, "roleplay_response": response}), 200
+
+    # except Exception as e:
+    #     return jsonify({"error": str(e)}), 500
+
+def evaluate_roleplay_video(student_id, video_file_path, scenario):
+    JOB_QUEUE.report_progress(0.1, "Evaluating video")
     response = EVALUATOR.evaluate_video_for_soft_skills(video_file_path, scenario)
     result = std_profile_coll.update_one(
         {"_id": ObjectId(student_id)},
@@ -185,11 +200,8 @@ def anaylze_conversation():
     )
     if result.matched_count == 0:
         print(f"something wrong--> {ObjectId(student_id)}")
-        return jsonify({"error": "User not found"}), 404
-    return jsonify({"response": True, "roleplay_response": response}), 200
-
-    # except Exception as e:
-    #     return jsonify({"error": str(e)}), 500
+        raise LookupError("User not found")
+    return response
 
 @job_seeker.route('/logout', methods=['GET'])
 @cross_origin(supports_credentials=True)
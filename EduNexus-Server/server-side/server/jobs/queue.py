@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from flask import current_app, has_app_context
+from api.response_cache import CACHE_DIRECTORY
+from api.storage import connect, init_database
+
+load_dotenv()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(CACHE_DIRECTORY, "jobs.sqlite3"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(24 * 60 * 60)))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueue:
+    """Runs long generation tasks on a local worker pool and keeps their status in a SQLite job table, so a
+    request can return a job id straight away and the client can poll for the result."""
+    def __init__(self, path=JOB_DB_PATH, max_workers=JOB_WORKERS, retention_seconds=JOB_RETENTION_SECONDS):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._current = threading.local()
+        init_database(
+            path,
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, owner TEXT, status TEXT NOT NULL, "
+            "progress REAL NOT NULL DEFAULT 0, message TEXT, result TEXT, error TEXT, pid INTEGER, created_at REAL NOT NULL, updated_at REAL NOT NULL)",
+        )
+        self.mark_interrupted()
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with connect(self.path) as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def submit(self, kind, func, *args, owner=None, **kwargs):
+        """Queue func(*args, **kwargs) and return the job id. func may be a coroutine function. It runs without a
+        request context, so everything it needs from the session must be passed in explicitly."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner, status, progress, pid, created_at, updated_at) VALUES (?, ?, ?, ?, 0, ?, ?, ?)",
+                (job_id, kind, owner, QUEUED, os.getpid(), now, now),
+            )
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (SUCCEEDED, FAILED, now - self.retention_seconds))
+        app = current_app._get_current_object() if has_app_context() else None
+        self._executor.submit(self._run, job_id, app, func, args, kwargs)
+        print(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def _run(self, job_id, app, func, args, kwargs):
+        self._current.job_id = job_id
+        self._update(job_id, status=RUNNING)
+        try:
+            if app is not None:
+                with app.app_context():
+                    result = self._call(func, args, kwargs)
+            else:
+                result = self._call(func, args, kwargs)
+            self._update(job_id, status=SUCCEEDED, progress=1.0, result=json.dumps(result))
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e))
+        finally:
+            self._current.job_id = None
+
+    @staticmethod
+    def _call(func, args, kwargs):
+        result = func(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            result = asyncio.run(result)
+        return result
+
+    def report_progress(self, progress, message=None):
+        """Record progress (0 to 1) for the job running on this thread. Does nothing outside of a job, so the
+        same function can back both the synchronous route and the background job."""
+        job_id = getattr(self._current, "job_id", None)
+        if job_id is not None:
+            self._update(job_id, progress=progress, message=message)
+
+    def get(self, job_id):
+        with connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT id, kind, owner, status, progress, message, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("job_id", "kind", "owner", "status", "progress", "message", "result", "error", "created_at", "updated_at"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def mark_interrupted(self):
+        """Jobs left queued or running by a process that no longer exists will never finish; fail them so clients
+        stop polling. Jobs owned by other live worker processes sharing the table are left alone."""
+        with connect(self.path) as conn:
+            rows = conn.execute("SELECT id, pid FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+            for job_id, pid in rows:
+                # A job recorded under our own pid predates this queue instance (e.g. a restarted container where the pid is reused).
+                if pid is None or pid == os.getpid() or not _process_alive(pid):
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (FAILED, "Interrupted by a server restart", time.time(), job_id),
+                    )
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # PermissionError means the process exists but belongs to someone else; OSError covers platforms without signal 0.
+        return True
+    return True
@@ -0,0 +1,57 @@
+from flask import jsonify, Blueprint, session
+from flask_cors import cross_origin
+from server.constants import JOB_QUEUE
+from server.jobs.queue import SUCCEEDED, FAILED
+
+jobs = Blueprint(name='jobs', import_name=__name__)
+
+
+def current_owner():
+    for role, key in (("teacher", "teacher_id"), ("student", "user_id"), ("job_seeker", "student_id")):
+        if session.get(key) is not None:
+            return f"{role}:{session.get(key)}"
+    return None
+
+
+def find_job(job_id):
+    job = JOB_QUEUE.get(job_id)
+    if job is None or job["owner"] != current_owner():
+        return None
+    return job
+
+
+@jobs.route('/<string:job_id>', methods=['GET'])
+@cross_origin(supports_credentials=True)
+def job_status(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found", "response": False}), 404
+    return jsonify({
+        "job_id": job["job_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "message": job["message"],
+        "error": job["error"],
+        "response": True,
+    }), 200
+
+
+@jobs.route('/<string:job_id>/result', methods=['GET'])
+@cross_origin(supports_credentials=True)
+def job_result(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found", "response": False}), 404
+    if job["status"] == FAILED:
+        return jsonify({"message": job["error"], "status": job["status"], "response": False}), 500
+    if job["status"] != SUCCEEDED:
+        return jsonify({"message": "Job not finished", "status": job["status"], "progress": job["progress"], "response": False}), 202
+
+    result = job["result"]
+    # Jobs run outside of the request, so anything the synchronous route would have put in the session is
+    # returned as session_updates and applied here, when the owner collects the result.
+    if isinstance(result, dict) and "session_updates" in result:
+        result = dict(result)
+        session.update(result.pop("session_updates"))
+    return jsonify({"message": "Query successful", "status": job["status"], "result": result, "response": True}), 200
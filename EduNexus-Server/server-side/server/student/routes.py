@@ -6,16 +6,18 @@ from server import db, bcrypt
 from datetime import datetime
 from gtts import gTTS
 from sqlalchemy import desc
-from deep_translator import GoogleTranslator
-from flask import request, session, jsonify, send_file, Blueprint
+from flask import request, session, jsonify, send_file, Blueprint, Response, stream_with_context
 from models.student_schema import User, Topic, Module, CompletedModule, Query, OngoingModule
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from flask_cors import cross_origin
 from werkzeug.utils import secure_filename
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 from api.serper_client import SerperProvider
+from api.translation import TRANSLATION_ENGINE
+from models.index_registry import INDEX_REGISTRY, IndexRegistry
 from server.constants import *
 from server.utils import ServerUtils
 from pymongo import MongoClient
@@ -289,7 +291,7 @@ def doc_query_topic(topicname,level,source_lang):
     if 'file' not in request.files:
         return 'No file part', 400
     file = request.files['file']
-    uploads_path = os.path.join('server', 'uploads')
+    uploads_path = os.path.join('server', 'uploads', str(user_id))
     if file.filename == '':
         return 'No selected file', 400
     if not os.path.exists(uploads_path):
@@ -299,14 +301,19 @@ def doc_query_topic(topicname,level,source_lang):
         file.save(os.path.join(uploads_path, filename))
     
     docs_path = os.path.join(uploads_path, filename)
-    loader = PyPDFLoader(docs_path)
-    docs = loader.load()
-    docs_splitter = RecursiveCharacterTextSplitter(chunk_size=700, chunk_overlap=150)
-    split_docs = docs_splitter.split_documents(docs)
-    TEXTBOOK_VECTORSTORE = FAISS.from_documents(split_docs, EMBEDDINGS)
-    TEXTBOOK_VECTORSTORE.save_local('teacher_docs')
-    print('CREATED VECTORSTORE')
-    VECTORDB_TEXTBOOK = FAISS.load_local('teacher_docs', EMBEDDINGS, allow_dangerous_deserialization=True)
+    # Keyed by user and file content so students uploading at the same time keep separate indexes.
+    user_docs_path = os.path.join(USER_DOCS_PATH, IndexRegistry.namespace(user_id, IndexRegistry.content_hash([docs_path], extra=[700, 150, EMBEDDINGS.model_name])))
+    if os.path.exists(user_docs_path):
+        VECTORDB_TEXTBOOK = INDEX_REGISTRY.get_text(user_docs_path, EMBEDDINGS)
+    else:
+        loader = PyPDFLoader(docs_path)
+        docs = loader.load()
+        docs_splitter = RecursiveCharacterTextSplitter(chunk_size=700, chunk_overlap=150)
+        split_docs = docs_splitter.split_documents(docs)
+        VECTORDB_TEXTBOOK = FAISS.from_documents(split_docs, EMBEDDINGS)
+        INDEX_REGISTRY.save_text(user_docs_path, VECTORDB_TEXTBOOK)
+        print('CREATED VECTORSTORE')
+    session['user_docs_path'] = user_docs_path
 
     if source_lang == 'auto':
         source_language = ServerUtils.detect_source_language(topicname)
@@ -315,7 +322,7 @@ def doc_query_topic(topicname,level,source_lang):
         source_language=source_lang
         print(f"Source Language: {source_language}")
 
-    trans_topic_name = GoogleTranslator(source='auto', target='en').translate(topicname)
+    trans_topic_name = TRANSLATION_ENGINE.translate(topicname, 'en', source='auto')
     print(f"Translated topic name: {trans_topic_name}")
 
     topic = Topic.query.filter_by(topic_name=trans_topic_name.lower()).first()
@@ -346,12 +353,9 @@ def doc_query_topic(topicname,level,source_lang):
     db.session.add(new_user_query)
     db.session.commit()
 
-    trans_moduleids = {}
     if source_language !='english':
-        for key, value in module_ids.items():
-            trans_key = GoogleTranslator(source='en', target=source_language).translate(str(key))
-            trans_moduleids[trans_key]=value
-        module_ids=trans_moduleids
+        trans_keys = TRANSLATION_ENGINE.translate_batch(list(module_ids), source_language, source='en')
+        module_ids = dict(zip(trans_keys, module_ids.values()))
     trans_module_summary_content = ServerUtils.translate_module_summary(module_summary_content, source_language)
 
     return jsonify({"message": "Query successful", "topic_id":topic.topic_id, "topic":trans_topic_name, "source_language":source_language, "module_ids":module_ids, "content": trans_module_summary_content, "response":True}), 200
@@ -371,7 +375,7 @@ def personalized_module_content():
     title=session['title']
     topic=session['topic']
     description=session['user_profile']
-    VECTORDB_TEXTBOOK = FAISS.load_local(USER_DOCS_PATH, EMBEDDINGS, allow_dangerous_deserialization=True)
+    VECTORDB_TEXTBOOK = INDEX_REGISTRY.get_text(session['user_docs_path'], EMBEDDINGS)
     # new_module = PersonalizedModule(
     #     module_code=key,
     #     module_name=modulename,
@@ -383,22 +387,12 @@ def personalized_module_content():
     print("language",source_language)
     with ThreadPoolExecutor() as executor:
         submodules = session['submodules']
-        keys_list = list(submodules.keys())
         future_images_list = executor.submit(SerperProvider.module_image_from_web, submodules)
         # future_video_list = executor.submit(SerperProvider.module_videos_from_web, submodules)
-        submodules_split_one = {key: submodules[key] for key in keys_list[:2]}
-        submodules_split_two = {key: submodules[key] for key in keys_list[2:4]}
-        submodules_split_three = {key: submodules[key] for key in keys_list[4:]}
-        future_content_one = executor.submit(CONTENT_GENERATOR.generate_content_from_textbook,topic,title ,submodules_split_one,description,VECTORDB_TEXTBOOK,'first')
-        future_content_two = executor.submit(CONTENT_GENERATOR.generate_content_from_textbook,topic,title ,submodules_split_two,description,VECTORDB_TEXTBOOK,'second')
-        future_content_three = executor.submit(CONTENT_GENERATOR.generate_content_from_textbook,topic,title ,submodules_split_three,description,VECTORDB_TEXTBOOK,'third')
+        future_content = executor.submit(SUBMODULE_SCHEDULER.run, lambda split: CONTENT_GENERATOR.generate_content_from_textbook(topic, title, split, description, VECTORDB_TEXTBOOK), submodules)
 
     # Retrieve the results when both functions are done
-    content_one = future_content_one.result()
-    content_two = future_content_two.result()
-    content_three = future_content_three.result()
-
-    content = content_one + content_two + content_three
+    content = SUBMODULE_SCHEDULER.flatten(future_content.result())
     images_list = future_images_list.result()
     # video_list = future_video_list.result()
 
@@ -439,7 +433,7 @@ def query_topic(topicname,level,websearch,source_lang):
 
     trans_topic_name = ""
     if source_lang!="english":
-        trans_topic_name = GoogleTranslator(source=source_lang, target='en').translate(topicname)
+        trans_topic_name = TRANSLATION_ENGINE.translate(topicname, 'en', source=source_lang)
         print(f"Translated topic name: {trans_topic_name}")
     else:
         trans_topic_name = topicname
@@ -457,12 +451,9 @@ def query_topic(topicname,level,websearch,source_lang):
             module_summary_content = {module.module_name:module.summary for module in modules}
             trans_module_summary_content = ServerUtils.translate_module_summary(module_summary_content, source_language)
             print(f"Translated module summary content: {trans_module_summary_content}")
-            trans_moduleids = {}
             if source_language !='english':
-                for key, value in module_ids.items():
-                    trans_key = GoogleTranslator(source='en', target=source_language).translate(str(key))
-                    trans_moduleids[trans_key]=value
-                module_ids=trans_moduleids
+                trans_keys = TRANSLATION_ENGINE.translate_batch(list(module_ids), source_language, source='en')
+                module_ids = dict(zip(trans_keys, module_ids.values()))
             return jsonify({"message": "Query successful", "topic_id":topic.topic_id, "topic":trans_topic_name, "source_language":source_language, "module_ids":module_ids, "content": trans_module_summary_content, "response":True}), 200
 
 
@@ -490,12 +481,9 @@ def query_topic(topicname,level,websearch,source_lang):
     db.session.add(new_user_query)
     db.session.commit()
 
-    trans_moduleids = {}
     if source_language !='english':
-        for key, value in module_ids.items():
-            trans_key = GoogleTranslator(source='en', target=source_language).translate(str(key))
-            trans_moduleids[trans_key]=value
-        module_ids=trans_moduleids
+        trans_keys = TRANSLATION_ENGINE.translate_batch(list(module_ids), source_language, source='en')
+        module_ids = dict(zip(trans_keys, module_ids.values()))
     trans_module_summary_content = ServerUtils.translate_module_summary(module_summary_content, source_language)
     print(f"Translated module summary content: {trans_module_summary_content}")
 
@@ -514,6 +502,12 @@ def course_overview(module_id, source_language, websearch):
         return jsonify({"message": "User not found", "response": False}), 404
     session["module_id"] = module_id
     topic = session.get("topic")
+    if ServerUtils.run_in_background():
+        job_id = JOB_QUEUE.submit("course_overview", build_course_overview, user.user_id, module_id, topic, source_language, websearch, owner=f"student:{user_id}")
+        return jsonify({"message": "Job queued", "job_id": job_id, "response": True}), 202
+    return jsonify(build_course_overview(user.user_id, module_id, topic, source_language, websearch)), 200
+
+def build_course_overview(user_id, module_id, topic, source_language, websearch):
     module = Module.query.get(module_id)
     other_modules = Module.query.filter(Module.topic_id == module.topic_id,Module.level==module.level,Module.websearch==module.websearch, Module.module_id != module_id).all()
     modules_dict_list = [module.to_dict() for module in other_modules]
@@ -525,40 +519,44 @@ def course_overview(module_id, source_language, websearch):
     if module.submodule_content is not None:
         print("language",source_language)
         trans_submodule_content = ServerUtils.translate_submodule_content(module.submodule_content, source_language)
-        return jsonify({"message": "Query successful","other_modules":modules_dict_list,"module": module_info ,"images": module.image_urls,"videos": module.video_urls, "content": trans_submodule_content, "response": True}), 200
+        return {"message": "Query successful","other_modules":modules_dict_list,"module": module_info ,"images": module.image_urls,"videos": module.video_urls, "content": trans_submodule_content, "response": True}
     
+    # When a whole class opens the same module at once, only the first request generates it; the rest wait for that result.
+    generated = MODULE_SINGLE_FLIGHT.do(module_id, generate_module_content, module_id, topic, websearch)
+    content = generated["content"]
+
+    ongoing_module = OngoingModule(user_id=user_id, module_id=module_id, level=module.level)
+    db.session.add(ongoing_module)
+    db.session.commit()
+
+    trans_submodule_content = ServerUtils.translate_submodule_content(content, source_language)
+    
+    return {"message": "Query successful","other_modules": modules_dict_list,"module": module_info ,"images": generated["images"],"videos": generated["videos"] ,"content": trans_submodule_content,"sub_modules": generated["sub_modules"], "response": True}
+
+def generate_module_content(module_id, topic, websearch):
+    module = Module.query.get(module_id)
+    db.session.refresh(module)
+    if module.submodule_content is not None:
+        # Generated by a request that finished between our caller's check and this one starting.
+        return {"content": module.submodule_content, "images": module.image_urls, "videos": module.video_urls, "sub_modules": None}
+
+    JOB_QUEUE.report_progress(0.1, "Generating content")
     with ThreadPoolExecutor() as executor:
         if websearch == "true":
             submodules = SUB_MODULE_GENERATOR.generate_submodules_from_web(module.module_name,module.summary)
             print(submodules)
-            keys_list = list(submodules.keys())
             future_images_list = executor.submit(SerperProvider.module_image_from_web, submodules)
             future_video_list = executor.submit(SerperProvider.module_videos_from_web, submodules)
-            submodules_split_one = {key: submodules[key] for key in keys_list[:2]}
-            submodules_split_two = {key: submodules[key] for key in keys_list[2:4]}
-            submodules_split_three = {key: submodules[key] for key in keys_list[4:]}
-            future_content_one = executor.submit(CONTENT_GENERATOR.generate_content_from_web, submodules_split_one, module.module_name,topic, 'first')
-            future_content_two = executor.submit(CONTENT_GENERATOR.generate_content_from_web, submodules_split_two, module.module_name,topic, 'second')
-            future_content_three = executor.submit(CONTENT_GENERATOR.generate_content_from_web, submodules_split_three, module.module_name,topic, 'third')
+            future_content = executor.submit(SUBMODULE_SCHEDULER.run, lambda split: CONTENT_GENERATOR.generate_content_from_web(split, module.module_name, topic), submodules)
 
         else:
             submodules = SUB_MODULE_GENERATOR.generate_submodules(module.module_name)
             print(submodules)
-            keys_list = list(submodules.keys())
             future_images_list = executor.submit(SerperProvider.module_image_from_web, submodules)
             future_video_list = executor.submit(SerperProvider.module_videos_from_web, submodules)
-            submodules_split_one = {key: submodules[key] for key in keys_list[:2]}
-            submodules_split_two = {key: submodules[key] for key in keys_list[2:4]}
-            submodules_split_three = {key: submodules[key] for key in keys_list[4:]}
-            future_content_one = executor.submit(CONTENT_GENERATOR.generate_content, submodules_split_one, module.module_name,topic,'first')
-            future_content_two = executor.submit(CONTENT_GENERATOR.generate_content, submodules_split_two, module.module_name,topic,'second')
-            future_content_three = executor.submit(CONTENT_GENERATOR.generate_content, submodules_split_three, module.module_name,topic,'third')
-
-    content_one = future_content_one.result()
-    content_two = future_content_two.result()
-    content_three = future_content_three.result()
-
-    content = content_one + content_two + content_three
+            future_content = executor.submit(SUBMODULE_SCHEDULER.run, lambda split: CONTENT_GENERATOR.generate_content(split, module.module_name, topic), submodules)
+
+    content = SUBMODULE_SCHEDULER.flatten(future_content.result())
     images_list = future_images_list.result()
     video_list = future_video_list.result()
 
@@ -566,14 +564,120 @@ def course_overview(module_id, source_language, websearch):
     module.image_urls = images_list
     module.video_urls = video_list
     db.session.commit()
+    return {"content": content, "images": images_list, "videos": video_list, "sub_modules": submodules}
 
-    ongoing_module = OngoingModule(user_id=user.user_id, module_id=module_id, level=module.level)
-    db.session.add(ongoing_module)
-    db.session.commit()
 
-    trans_submodule_content = ServerUtils.translate_submodule_content(content, source_language)
-    
-    return jsonify({"message": "Query successful","other_modules": modules_dict_list,"module": module_info ,"images": module.image_urls,"videos": module.video_urls ,"content": trans_submodule_content,"sub_modules": submodules, "response": True}), 200
+# course overview as server-sent events --> each submodule is sent as soon as its content and images are ready
+@students.route('/query2/course-overview-stream/<int:module_id>/<string:source_language>/<string:websearch>', methods=['GET'])
+@cross_origin(supports_credentials=True)
+def course_overview_stream(module_id, source_language, websearch):
+    user_id = session.get("user_id", None)
+    if user_id is None:
+        return jsonify({"message": "User not logged in", "response": False}), 401
+
+    user = User.query.get(user_id)
+    if user is None:
+        return jsonify({"message": "User not found", "response": False}), 404
+    session["module_id"] = module_id
+    topic = session.get("topic")
+    module = Module.query.get(module_id)
+    other_modules = Module.query.filter(Module.topic_id == module.topic_id,Module.level==module.level,Module.websearch==module.websearch, Module.module_id != module_id).all()
+    modules_dict_list = [module.to_dict() for module in other_modules]
+    module_info = {}
+    module_info['module_name']=module.module_name
+    module_info['summary']=module.summary
+    module_info['level']=module.level
+
+    def generated_events(content, images_list, video_list):
+        trans_submodule_content = ServerUtils.translate_submodule_content(content, source_language)
+        images_list = images_list or []
+        for index, content in enumerate(trans_submodule_content):
+            yield ServerUtils.sse_event("submodule", {"index": index, "content": content, "images": images_list[index] if index < len(images_list) else []})
+        yield ServerUtils.sse_event("done", {"message": "Query successful", "videos": video_list, "response": True})
+
+    def event_stream():
+        yield ServerUtils.sse_event("module", {"other_modules": modules_dict_list, "module": module_info})
+
+        if module.submodule_content is not None:
+            yield from generated_events(module.submodule_content, module.image_urls, module.video_urls)
+            return
+
+        # Same key as course_overview: whichever request for this module arrives first generates it, and every
+        # other request, streamed or not, waits for that result instead of generating and saving its own.
+        future, leader = MODULE_SINGLE_FLIGHT.begin(module_id)
+        if not leader:
+            try:
+                generated = future.result()
+            except Exception as e:
+                print(f"Error while streaming course overview: {e}")
+                yield ServerUtils.sse_event("error", {"message": "An error occurred while generating the module.", "response": False})
+                return
+            ongoing_module = OngoingModule(user_id=user.user_id, module_id=module_id, level=module.level)
+            db.session.add(ongoing_module)
+            db.session.commit()
+            if generated["sub_modules"] is not None:
+                yield ServerUtils.sse_event("submodules", {"sub_modules": generated["sub_modules"]})
+            yield from generated_events(generated["content"], generated["images"], generated["videos"])
+            return
+
+        try:
+            db.session.refresh(module)
+        except Exception as e:
+            MODULE_SINGLE_FLIGHT.finish(module_id, future, error=e)
+            raise
+        if module.submodule_content is not None:
+            # Generated by a request that finished between the check above and this one becoming the leader.
+            MODULE_SINGLE_FLIGHT.finish(module_id, future, {"content": module.submodule_content, "images": module.image_urls, "videos": module.video_urls, "sub_modules": None})
+            yield from generated_events(module.submodule_content, module.image_urls, module.video_urls)
+            return
+
+        try:
+            if websearch == "true":
+                submodules = SUB_MODULE_GENERATOR.generate_submodules_from_web(module.module_name,module.summary)
+                generate_content = CONTENT_GENERATOR.generate_content_from_web
+            else:
+                submodules = SUB_MODULE_GENERATOR.generate_submodules(module.module_name)
+                generate_content = CONTENT_GENERATOR.generate_content
+            yield ServerUtils.sse_event("submodules", {"sub_modules": submodules})
+
+            tasks = {
+                index: partial(ServerUtils.generate_submodule_with_images, generate_content, key, val, module.module_name, topic)
+                for index, (key, val) in enumerate(submodules.items())
+            }
+            tasks["videos"] = partial(SerperProvider.module_videos_from_web, submodules)
+            content = [None] * len(submodules)
+            images_list = [None] * len(submodules)
+            video_list = []
+            for index, result in ServerUtils.iterate_as_completed(tasks, max_workers=SUBMODULE_SCHEDULER.max_concurrency + 1):
+                if index == "videos":
+                    video_list = result
+                    continue
+                content[index], images_list[index] = result
+                trans_content = ServerUtils.translate_submodule_content([content[index]], source_language)[0]
+                yield ServerUtils.sse_event("submodule", {"index": index, "content": trans_content, "images": images_list[index]})
+
+            module.submodule_content = content
+            module.image_urls = images_list
+            module.video_urls = video_list
+            db.session.commit()
+        except GeneratorExit:
+            # The client went away mid-stream; release the requests waiting on this one.
+            MODULE_SINGLE_FLIGHT.finish(module_id, future, error=RuntimeError("The request generating this module was closed"))
+            raise
+        except Exception as e:
+            print(f"Error while streaming course overview: {e}")
+            MODULE_SINGLE_FLIGHT.finish(module_id, future, error=e)
+            yield ServerUtils.sse_event("error", {"message": "An error occurred while generating the module.", "response": False})
+            return
+        MODULE_SINGLE_FLIGHT.finish(module_id, future, {"content": content, "images": images_list, "videos": video_list, "sub_modules": submodules})
+
+        ongoing_module = OngoingModule(user_id=user.user_id, module_id=module_id, level=module.level)
+        db.session.add(ongoing_module)
+        db.session.commit()
+
+        yield ServerUtils.sse_event("done", {"message": "Query successful", "videos": video_list, "response": True})
+
+    return Response(stream_with_context(event_stream()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 # module query --> generate mutlimodal content (with images) for submodules in a module
@@ -617,8 +721,7 @@ def download_pdf(module_id, source_language):
     module_summary = module.summary
     submodule_content = module.submodule_content
 
-    trans_modulename = GoogleTranslator(source='en', target=source_language).translate(modulename)
-    trans_module_summary = GoogleTranslator(source='en', target=source_language).translate(module_summary)
+    trans_modulename, trans_module_summary = TRANSLATION_ENGINE.translate_batch([modulename, module_summary], source_language, source='en')
     trans_submodule_content = ServerUtils.translate_submodule_content(submodule_content, source_language)
 
     download_dir = os.path.join(os.getcwd(), "server", "downloads")
@@ -815,7 +918,7 @@ def chatbot_route():
     if query:
         source_language = ServerUtils.detect_source_language(query)
         if source_language != 'english':
-            trans_query = GoogleTranslator(source=source_language, target='english').translate(query)
+            trans_query = TRANSLATION_ENGINE.translate(query, 'english', source=source_language)
         else:
             trans_query = query
         print(trans_query)
@@ -825,7 +928,7 @@ def chatbot_route():
         response_text = response.text  # Assuming response.text is a string
         
         if source_language != 'english':
-            trans_output = GoogleTranslator(source='auto', target=source_language).translate(response_text)
+            trans_output = TRANSLATION_ENGINE.translate(response_text, source_language, source='auto')
         else:
             trans_output = response_text
         
@@ -7,11 +7,11 @@ from server import db, bcrypt
 from datetime import datetime
 from gtts import gTTS
 from sqlalchemy import desc
-from flask import request, session, jsonify, send_file, Blueprint, send_from_directory
+from flask import request, session, jsonify, send_file, Blueprint, send_from_directory, Response
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from flask_cors import cross_origin
 from werkzeug.utils import secure_filename
-from langchain_community.vectorstores import FAISS
 from api.serper_client import SerperProvider
 from core.rag import MultiModalRAG, SimpleRAG
 from server.constants import *
@@ -234,7 +234,7 @@ async def multimodal_rag_submodules():
     
     lesson_name = re.sub(r'[<>:"/\\|?*]', '_', lesson_name)
     current_dir = os.path.dirname(__file__)
-    uploads_path = os.path.join(current_dir, 'uploaded-documents', lesson_name)
+    uploads_path = os.path.join(current_dir, 'uploaded-documents', str(teacher_id), lesson_name)
     if not os.path.exists(uploads_path):
         os.makedirs(uploads_path)
     
@@ -261,6 +261,7 @@ async def multimodal_rag_submodules():
             course_name=course_name,
             lesson_name=lesson_name,
             lesson_type=lesson_type,
+            owner_id=teacher_id,
             documents_directory_path=uploads_path,  
             embeddings=EMBEDDINGS,
             clip_model=CLIP_MODEL,
@@ -277,6 +278,7 @@ async def multimodal_rag_submodules():
             course_name=course_name,
             lesson_name=lesson_name,
             lesson_type=lesson_type,
+            owner_id=teacher_id,
             documents_directory_path=uploads_path,  
             embeddings=EMBEDDINGS,
             clip_model=CLIP_MODEL,
@@ -293,6 +295,7 @@ async def multimodal_rag_submodules():
             course_name=course_name,
             lesson_name=lesson_name,
             lesson_type=lesson_type,
+            owner_id=teacher_id,
             documents_directory_path=uploads_path,  
             embeddings=EMBEDDINGS,
             clip_model=CLIP_MODEL,
@@ -308,6 +311,7 @@ async def multimodal_rag_submodules():
             course_name=course_name,
             lesson_name=lesson_name,
             lesson_type=lesson_type,
+            owner_id=teacher_id,
             documents_directory_path=uploads_path,  
             embeddings=EMBEDDINGS,
             clip_model=CLIP_MODEL,
@@ -341,28 +345,37 @@ async def multimodal_rag_submodules():
         print("\nGenerated Submodules:\n", submodules)
         return jsonify({"message": "Query successful", "submodules": submodules, "response": True}), 200
 
+    session_updates = {
+        'lesson_name': lesson_name,
+        'course_name': course_name,
+        'lesson_type': lesson_type,
+        'user_profile': description,
+        'document_directory_path': uploads_path,
+        'is_multimodal_rag': True,
+        'include_images': include_images,
+    }
+    if ServerUtils.run_in_background():
+        job_id = JOB_QUEUE.submit("multimodal_rag_submodules", create_multimodal_rag_submodules, multimodal_rag, lesson_name, course_name, search_web, session_updates, owner=f"teacher:{teacher_id}")
+        return jsonify({"message": "Job queued", "job_id": job_id, "response": True}), 202
+
+    result = await create_multimodal_rag_submodules(multimodal_rag, lesson_name, course_name, search_web, session_updates)
+    session.update(result["session_updates"])
+    return jsonify({"message": "Query successful", "submodules": result["submodules"], "response": True}), 200
+
+async def create_multimodal_rag_submodules(multimodal_rag, lesson_name, course_name, search_web, session_updates):
+    JOB_QUEUE.report_progress(0.1, "Creating vectorstores")
     text_vectorstore_path, image_vectorstore_path = await multimodal_rag.create_text_and_image_vectorstores()
     
-    session['text_vectorstore_path'] = text_vectorstore_path
-    session['image_vectorstore_path'] = image_vectorstore_path
-    
-    VECTORDB_TEXTBOOK = FAISS.load_local(text_vectorstore_path, EMBEDDINGS, allow_dangerous_deserialization=True)
+    VECTORDB_TEXTBOOK = multimodal_rag.text_vectorstore
     
+    JOB_QUEUE.report_progress(0.7, "Generating submodules")
     if search_web:
         submodules = await SUB_MODULE_GENERATOR.generate_submodules_from_documents_and_web(module_name=lesson_name, course_name=course_name, vectordb=VECTORDB_TEXTBOOK)
     else:
         submodules = SUB_MODULE_GENERATOR.generate_submodules_from_textbook(lesson_name, VECTORDB_TEXTBOOK)
-        
-    session['lesson_name'] = lesson_name
-    session['course_name'] = course_name
-    session['lesson_type'] = lesson_type
-    session['user_profile'] = description
-    session['submodules'] = submodules
-    session['document_directory_path'] = uploads_path 
-    session['is_multimodal_rag'] = True
-    session['include_images']=include_images
     print("\nGenerated Submodules:\n", submodules)
-    return jsonify({"message": "Query successful", "submodules": submodules, "response": True}), 200
+    session_updates = dict(session_updates, text_vectorstore_path=text_vectorstore_path, image_vectorstore_path=image_vectorstore_path, submodules=submodules)
+    return {"submodules": submodules, "session_updates": session_updates}
 
 @teachers.route('/update-submodules', methods=['POST'])
 def update_submodules():
@@ -370,6 +383,25 @@ def update_submodules():
     session['submodules'] = updated_submodules
     return jsonify({'message': 'Submodules updated successfully'}), 200
 
+def multimodal_rag_from_session():
+    return MultiModalRAG(
+        course_name=session.get("course_name"),
+        documents_directory_path=session.get("document_directory_path"),
+        lesson_name=session.get("lesson_name"),
+        owner_id=session.get("teacher_id"),
+        embeddings=EMBEDDINGS,
+        clip_model=CLIP_MODEL,
+        clip_processor=CLIP_PROCESSOR,
+        clip_tokenizer=CLIP_TOKENIZER,
+        chunk_size=1000,
+        chunk_overlap=200,
+        image_similarity_threshold=0.1,
+        input_type=session.get('input_type'),
+        text_vectorstore_path=session.get("text_vectorstore_path"),
+        image_vectorstore_path=session.get("image_vectorstore_path"),
+        include_images=session.get('include_images')
+    )
+
 @teachers.route('/multimodal-rag-content', methods=['GET'])
 async def multimodal_rag_content():
     teacher_id = session.get('teacher_id')
@@ -384,65 +416,67 @@ async def multimodal_rag_content():
     user_profile = session.get("user_profile")
     submodules = session.get("submodules")
     if is_multimodal_rag:
-        document_paths = session.get("document_directory_path") 
-        text_vectorstore_path = session.get("text_vectorstore_path")
-        image_vectorstore_path = session.get("image_vectorstore_path")
-        input_type = session.get('input_type')
-        include_images=session.get('include_images')
-        multimodal_rag = MultiModalRAG(
-            course_name=course_name,
-            documents_directory_path=document_paths,
-            lesson_name=lesson_name,
-            embeddings=EMBEDDINGS,
-            clip_model=CLIP_MODEL,
-            clip_processor=CLIP_PROCESSOR,
-            clip_tokenizer=CLIP_TOKENIZER,
-            chunk_size=1000,
-            chunk_overlap=200,
-            image_similarity_threshold=0.1,
-            input_type=input_type,
-            text_vectorstore_path=text_vectorstore_path,
-            image_vectorstore_path=image_vectorstore_path,
-            include_images=include_images
-        )
-        content_list, relevant_images_list = await multimodal_rag.execute(CONTENT_GENERATOR, TAVILY_CLIENT, lesson_name, submodules=submodules, profile=user_profile, top_k_docs=7, search_web=search_web)
+        multimodal_rag = multimodal_rag_from_session()
+        content_list, relevant_images_list = await multimodal_rag.execute(CONTENT_GENERATOR, TAVILY_CLIENT, lesson_name, submodules=submodules, profile=user_profile, top_k_docs=7, search_web=search_web, scheduler=SUBMODULE_SCHEDULER)
         final_content = ServerUtils.json_list_to_markdown(content_list)
         return jsonify({"message": "Query successful", "relevant_images": relevant_images_list, "content": final_content, "response": True}), 200
     elif search_web:
-        keys_list = list(submodules.keys())
-        submodules_split_one = {key: submodules[key] for key in keys_list[:2]}
-        submodules_split_two = {key: submodules[key] for key in keys_list[2:4]}
-        submodules_split_three = {key: submodules[key] for key in keys_list[4:]}
         with ThreadPoolExecutor() as executor:
             future_images_list = executor.submit(SerperProvider.module_image_from_web, submodules)
-            future_content_one = executor.submit(CONTENT_GENERATOR.generate_content_from_web_with_profile, submodules_split_one, lesson_name, course_name, lesson_type, user_profile, 'first')
-            future_content_two = executor.submit(CONTENT_GENERATOR.generate_content_from_web_with_profile, submodules_split_two, lesson_name, course_name, lesson_type, user_profile, 'second')
-            future_content_three = executor.submit(CONTENT_GENERATOR.generate_content_from_web_with_profile, submodules_split_three, lesson_name, course_name, lesson_type, user_profile, 'third')
-        content_one = future_content_one.result()
-        content_two = future_content_two.result()
-        content_three = future_content_three.result()
+            future_content = executor.submit(SUBMODULE_SCHEDULER.run, lambda split: CONTENT_GENERATOR.generate_content_from_web_with_profile(split, lesson_name, course_name, lesson_type, user_profile), submodules)
         relevant_images_list = future_images_list.result()
-        content_list = content_one + content_two + content_three
+        content_list = SUBMODULE_SCHEDULER.flatten(future_content.result())
         final_content = ServerUtils.json_list_to_markdown(content_list)
         return jsonify({"message": "Query successful", "relevant_images": relevant_images_list, "content": final_content, "response": True}), 200
     else:
-        keys_list = list(submodules.keys())
-        submodules_split_one = {key: submodules[key] for key in keys_list[:2]}
-        submodules_split_two = {key: submodules[key] for key in keys_list[2:4]}
-        submodules_split_three = {key: submodules[key] for key in keys_list[4:]}
         with ThreadPoolExecutor() as executor:
             future_images_list = executor.submit(SerperProvider.module_image_from_web, submodules)
-            future_content_one = executor.submit(CONTENT_GENERATOR.generate_content_with_profile, submodules_split_one, lesson_name, course_name, lesson_type, user_profile, 'first')
-            future_content_two = executor.submit(CONTENT_GENERATOR.generate_content_with_profile, submodules_split_two, lesson_name, course_name, lesson_type, user_profile, 'second')
-            future_content_three = executor.submit(CONTENT_GENERATOR.generate_content_with_profile, submodules_split_three, lesson_name, course_name, lesson_type, user_profile, 'third')
-        content_one = future_content_one.result()
-        content_two = future_content_two.result()
-        content_three = future_content_three.result()
+            future_content = executor.submit(SUBMODULE_SCHEDULER.run, lambda split: CONTENT_GENERATOR.generate_content_with_profile(split, lesson_name, course_name, lesson_type, user_profile), submodules)
         relevant_images_list = future_images_list.result()
-        content_list = content_one + content_two + content_three
+        content_list = SUBMODULE_SCHEDULER.flatten(future_content.result())
         final_content = ServerUtils.json_list_to_markdown(content_list)
         return jsonify({"message": "Query successful", "relevant_images": relevant_images_list, "content": final_content, "response": True}), 200
 
+@teachers.route('/multimodal-rag-content/stream', methods=['GET'])
+def multimodal_rag_content_stream():
+    teacher_id = session.get('teacher_id')
+    if teacher_id is None:
+        return jsonify({"message": "Teacher not logged in", "response": False}), 401
+
+    is_multimodal_rag = session.get("is_multimodal_rag")
+    search_web = session.get("search_web")
+    course_name = session.get("course_name")
+    lesson_name = session.get("lesson_name")
+    lesson_type = session.get("lesson_type")
+    user_profile = session.get("user_profile")
+    submodules = session.get("submodules")
+    if is_multimodal_rag:
+        multimodal_rag = multimodal_rag_from_session()
+        results = ServerUtils.iterate_async(multimodal_rag.stream(CONTENT_GENERATOR, TAVILY_CLIENT, lesson_name, submodules=submodules, profile=user_profile, top_k_docs=7, search_web=search_web, scheduler=SUBMODULE_SCHEDULER))
+    else:
+        generate_content = CONTENT_GENERATOR.generate_content_from_web_with_profile if search_web else CONTENT_GENERATOR.generate_content_with_profile
+        tasks = {
+            index: partial(ServerUtils.generate_submodule_with_images, generate_content, key, val, lesson_name, course_name, lesson_type, user_profile)
+            for index, (key, val) in enumerate(submodules.items())
+        }
+        results = ServerUtils.iterate_as_completed(tasks, max_workers=SUBMODULE_SCHEDULER.max_concurrency)
+
+    def event_stream():
+        yield ServerUtils.sse_event("submodules", {"submodules": submodules})
+        try:
+            for index, (content, relevant_images) in results:
+                final_content = ServerUtils.json_list_to_markdown([content])[0]
+                yield ServerUtils.sse_event("submodule", {"index": index, "content": final_content, "relevant_images": relevant_images})
+        except Exception as e:
+            print(f"Error while streaming lesson content: {e}")
+            yield ServerUtils.sse_event("error", {"message": "An error occurred while generating the content.", "response": False})
+            return
+        finally:
+            results.close()
+        yield ServerUtils.sse_event("done", {"message": "Query successful", "response": True})
+
+    return Response(event_stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @teachers.route('/add-lesson', methods=['POST'])
 def add_lesson():
     teacher_id = session.get('teacher_id')
@@ -525,22 +559,31 @@ async def generate_lesson():
     course_name = request.form.get('course_name')
     file = request.files.get('syllabus')
     current_dir = os.path.dirname(__file__)
-    uploads_path = os.path.join(current_dir, 'uploaded-documents', 'syllabus')
+    uploads_path = os.path.join(current_dir, 'uploaded-documents', 'syllabus', str(teacher_id), secure_filename(course_name or 'course'))
     if not os.path.exists(uploads_path):
         os.makedirs(uploads_path)
     if file:
         filename = secure_filename(file.filename)
         file.save(os.path.join(uploads_path, filename))
 
+    if ServerUtils.run_in_background():
+        job_id = JOB_QUEUE.submit("lesson_plan", create_lesson_plan, course_name, uploads_path, num_lectures, owner=f"teacher:{teacher_id}")
+        return jsonify({"message": "Job queued", "job_id": job_id, "response": True}), 202
+
+    output = await create_lesson_plan(course_name, uploads_path, num_lectures)
+    return jsonify({"message": "Query successful", "lessons": output, "response": True}), 200
+
+async def create_lesson_plan(course_name, uploads_path, num_lectures):
     simple_rag = SimpleRAG(
         course_name=course_name,
         syllabus_directory_path=uploads_path,
         embeddings=EMBEDDINGS,
     )
+    JOB_QUEUE.report_progress(0.1, "Reading syllabus")
     await simple_rag.create_text_vectorstore()
     relevant_text = await simple_rag.search_similar_text(query=course_name, k=10)
-    output = LESSON_PLANNER.generate_lesson_plan(course_name=course_name, context=relevant_text, num_lectures=num_lectures)
-    return jsonify({"message": "Query successful", "lessons": output, "response": True}), 200
+    JOB_QUEUE.report_progress(0.5, "Generating lesson plan")
+    return LESSON_PLANNER.generate_lesson_plan(course_name=course_name, context=relevant_text, num_lectures=num_lectures)
 
 @teachers.route('/generate-lab-manual', methods=['POST'])
 def generate_lab_manual():
@@ -563,8 +606,7 @@ def generate_lab_manual():
     else:
         include_videos=False
     components = data.get('lab_components', [])
-
-    result = LAB_MANUAL_GENERATOR.generate_lab_manual(
+    lab_manual_args = dict(
         experiment_aim=exp_aim,
         experiment_num=experiment_num,
         teacher_name=teacher_name,
@@ -572,6 +614,11 @@ def generate_lab_manual():
         components=components,
         include_videos=include_videos
     )
+    if ServerUtils.run_in_background():
+        job_id = JOB_QUEUE.submit("lab_manual", LAB_MANUAL_GENERATOR.generate_lab_manual, owner=f"teacher:{teacher_id}", **lab_manual_args)
+        return jsonify({"message": "Job queued", "job_id": job_id, "response": True}), 202
+
+    result = LAB_MANUAL_GENERATOR.generate_lab_manual(**lab_manual_args)
 
     return jsonify({"message": "Query successful", "MarkdownContent": result, "response": True}), 200
 
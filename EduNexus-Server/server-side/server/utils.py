@@ -1,10 +1,14 @@
 import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from gtts import gTTS
-from deep_translator import GoogleTranslator
-from flask import session
+from flask import session, request
 from models.student_schema import Module
 from models.teacher_schema import Course as TeacherCourse
 from lingua import LanguageDetectorBuilder
+from api.serper_client import SerperProvider
+from api.translation import TRANSLATION_ENGINE
 import random
 import string
 
@@ -16,92 +20,37 @@ class ServerUtils:
     def translate_module_summary(content, target_language):
         if target_language=='en':
             return content
-        
-        trans_content = {}
-        for key, value in content.items():
-            trans_key = GoogleTranslator(source='en', target=target_language).translate(str(key))
-            trans_content[trans_key] = GoogleTranslator(source='en', target=target_language).translate(str(value))
-        return trans_content
+        return TRANSLATION_ENGINE.translate_structure(content, target_language, source='en', translate_keys=True)
     
     @staticmethod
     def translate_submodule_content(content, target_language):
         if target_language=='en':
             return content
-        
-        trans_content = []
-        for entry in content:
-            temp = {}
-            for key, value in entry.items():
-                if key == 'urls':
-                    temp[key] = value
-                    continue
-                if key == 'subsections':
-                    temp[key] = []
-                    for subsection in value:
-                        temp_subsections = {}
-                        for sub_key, sub_value in subsection.items():
-                            temp_subsections[sub_key] = GoogleTranslator(source='auto', target=target_language).translate(str(sub_value))
-                        temp[key].append(temp_subsections)
-                else:
-                    temp[key] = GoogleTranslator(source='auto', target=target_language).translate(str(value))
-            trans_content.append(temp)
-        return trans_content
+        return TRANSLATION_ENGINE.translate_structure(content, target_language, skip_keys=('urls',))
     
     @staticmethod
     def translate_quiz(quiz_data, target_language):
         if target_language=='en':
             return quiz_data
-        
-        trans_quiz=[]
-        for entry in quiz_data:
-            temp = {}
-            for key, val in entry.items():
-                if key != 'options':
-                    temp[key] = GoogleTranslator(source='auto', target=target_language).translate(str(val))
-                else:
-                    temp[key] = []
-                    for option in val:
-                        temp[key].append(GoogleTranslator(source='auto', target=target_language).translate(str(option)))
-
-            trans_quiz.append(temp)
-        
-        return trans_quiz
+        return TRANSLATION_ENGINE.translate_structure(quiz_data, target_language)
     
     @staticmethod
     def translate_assignment(questions, target_language):
         if target_language=='en':
             return questions
-        
-        trans_questions=[]
-        for entry in questions:
-            trans_questions.append(GoogleTranslator(source='auto', target=target_language).translate(str(entry)))
-
-        return trans_questions
+        return TRANSLATION_ENGINE.translate_batch(questions, target_language)
     
     @staticmethod
     def translate_responses(responses, target_language):
         if target_language=='en':
             return responses
-        
-        trans_response = []
-        for entry in responses:
-            temp = {}
-            for key, val in entry.items():
-                temp[key] = GoogleTranslator(source='auto', target=target_language).translate(str(val))
-            trans_response.append(temp)
-        
-        return trans_response
+        return TRANSLATION_ENGINE.translate_structure(responses, target_language)
 
     @staticmethod
     def translate_evaluations(evaluations, target_language):
         if target_language=='en':
             return evaluations
-        
-        trans_eval = {}
-        for key, val in evaluations.items():
-            trans_eval[key] = GoogleTranslator(source='auto', target=target_language).translate(str(val))
-
-        return trans_eval
+        return TRANSLATION_ENGINE.translate_structure(evaluations, target_language)
     
     @staticmethod
     def text_to_speech(text, language='en', directory='audio_files'):
@@ -139,6 +88,54 @@ class ServerUtils:
             final_content.append({content["subject_name"]: markdown})
         return final_content
     
+    @staticmethod
+    def sse_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    @staticmethod
+    def iterate_async(async_iterable):
+        # Drives an async generator from a sync streaming response. Closing this generator (client
+        # disconnect) closes the async one, which cancels any generation still in flight.
+        loop = asyncio.new_event_loop()
+        iterator = async_iterable.__aiter__()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            if hasattr(iterator, "aclose"):
+                loop.run_until_complete(iterator.aclose())
+            loop.close()
+
+    @staticmethod
+    def iterate_as_completed(tasks : dict, max_workers=None):
+        # Runs each callable in `tasks` on a thread pool and yields (key, result) in completion order.
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {executor.submit(task): key for key, task in tasks.items()}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def run_in_background():
+        # Long-running routes opt into the job queue with background=true in the query string, form or JSON body.
+        value = request.values.get("background")
+        if value is None and request.is_json:
+            value = (request.get_json(silent=True) or {}).get("background")
+        return str(value).lower() == "true"
+
+    @staticmethod
+    def generate_submodule_with_images(generate_content, key, val, *args):
+        # generate_content is one of the ContentGenerator.generate_content* methods, called with a single submodule.
+        with ThreadPoolExecutor() as executor:
+            future_images = executor.submit(SerperProvider.module_image_from_web, {key: val})
+            future_content = executor.submit(generate_content, {key: val}, *args)
+        return future_content.result()[0], future_images.result()[0]
+
     @staticmethod
     def generate_course_code(course_collection, length=6):
         while True: